@@ -0,0 +1,279 @@
+# archive.py
+# Hot/cold archival of old transactions into compressed, month-partitioned NumPy files.
+# Each database has its own archive directory (archive_dir_for), since customer and
+# transaction ids are only unique within one database.
+#   python archive.py [HORIZON_DAYS]   -> archive everything older than the horizon, on every shard
+import os
+import sys
+from datetime import timedelta
+from functools import lru_cache
+import numpy as np
+from sqlalchemy import select, delete, insert, func, case
+from bank_db import engine, Transaction, CREDIT_TYPES, db_label, utcnow
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+CARRY = "carry_forward"  # hot-table row holding the net of everything archived for a customer
+
+transactions = Transaction.__table__
+COLUMNS = ("id", "customer_id", "amount", "type", "timestamp", "note", "ref")
+
+
+def archive_dir_for(bind):
+    """Archive directory of the database behind `bind` (an engine or connection).
+
+    DB_URL's is ARCHIVE_DIR, as before sharding; any other database (a shard
+    added by shards.split) gets a subdirectory of it named after its URL.
+    """
+    label = db_label(bind)
+    return os.path.join(ARCHIVE_DIR, label) if label else ARCHIVE_DIR
+
+
+def _partition_path(month, archive_dir):
+    return os.path.join(archive_dir, f"transactions_{month}.npz")
+
+
+def archived_until(archive_dir=ARCHIVE_DIR):
+    """Everything before this (naive UTC) datetime lives in the archive; None if nothing does."""
+    path = os.path.join(archive_dir, "CUTOFF")
+    if not os.path.exists(path):
+        return None
+    with open(path) as fs:
+        return np.datetime64(fs.read().strip()).astype("datetime64[us]").item()
+
+
+@lru_cache(maxsize=8)
+def _load(path, mtime):
+    with np.load(path) as z:
+        return {c: z[c] for c in COLUMNS}
+
+
+def load_partition(month, archive_dir=ARCHIVE_DIR):
+    # columns sorted by (customer_id, timestamp, id); None if the month was never archived
+    path = _partition_path(month, archive_dir)
+    if not os.path.exists(path):
+        return None
+    return _load(path, os.path.getmtime(path))
+
+
+def _partitions(archive_dir):
+    # months with a partition in archive_dir, oldest first
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(f[13:20] for f in os.listdir(archive_dir) if f.startswith("transactions_") and f.endswith(".npz"))
+
+
+def _save_partition(month, cols, archive_dir):
+    path = _partition_path(month, archive_dir)
+    if not len(cols["id"]):
+        os.remove(path)
+        return
+    order = np.lexsort((cols["id"], cols["timestamp"], cols["customer_id"]))
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, **{c: v[order] for c, v in cols.items()})
+    os.replace(tmp, path)
+
+
+def _merge_partition(month, cols, archive_dir):
+    old = load_partition(month, archive_dir)
+    if old is not None:
+        # a rerun after a crash re-exports rows that are already here; keep one copy of each.
+        # Rows copied from another shard keep that shard's ids, so compare (customer, id).
+        cols = {c: np.concatenate([old[c], cols[c]]) for c in COLUMNS}
+        _, keep = np.unique(np.stack([cols["customer_id"], cols["id"]]), axis=1, return_index=True)
+        cols = {c: v[keep] for c, v in cols.items()}
+    _save_partition(month, cols, archive_dir)
+
+
+def _write_partition(month, rows, archive_dir):
+    cols = {
+        "id": np.array([r[0] for r in rows], dtype=np.int64),
+        "customer_id": np.array([r[1] for r in rows], dtype=np.int64),
+        "amount": np.array([r[2] for r in rows], dtype=np.float64),
+        "type": np.array([r[3] for r in rows], dtype=str),
+        "timestamp": np.array([r[4] for r in rows], dtype="datetime64[us]"),
+        "note": np.array([r[5] or "" for r in rows], dtype=str),
+        "ref": np.array([r[6] or "" for r in rows], dtype=str),
+    }
+    _merge_partition(month, cols, archive_dir)
+
+
+def _set_cutoff(cutoff, archive_dir):
+    prev = archived_until(archive_dir)
+    if prev is None or cutoff > prev:
+        with open(os.path.join(archive_dir, "CUTOFF"), "w") as fs:
+            fs.write(cutoff.isoformat())
+
+
+def copy_customers(customer_ids, src_dir, dst_dir):
+    """Copy the archived rows of `customer_ids` from src_dir to dst_dir (see shards.split).
+
+    Safe to rerun; returns the number of rows copied.
+    """
+    until = archived_until(src_dir)
+    if until is None:
+        return 0
+    os.makedirs(dst_dir, exist_ok=True)
+    ids = np.array(sorted(customer_ids), dtype=np.int64)
+    n = 0
+    for month in _partitions(src_dir):
+        part = load_partition(month, src_dir)
+        mask = np.isin(part["customer_id"], ids)
+        if mask.any():
+            _merge_partition(month, {c: v[mask] for c, v in part.items()}, dst_dir)
+            n += int(mask.sum())
+    _set_cutoff(until, dst_dir)
+    return n
+
+
+def drop_customers(customer_ids, archive_dir):
+    """Remove the archived rows of `customer_ids` from archive_dir, once copy_customers() put them elsewhere."""
+    ids = np.array(sorted(customer_ids), dtype=np.int64)
+    for month in _partitions(archive_dir):
+        part = load_partition(month, archive_dir)
+        mask = np.isin(part["customer_id"], ids, invert=True)
+        if not mask.all():
+            _save_partition(month, {c: v[mask] for c, v in part.items()}, archive_dir)
+
+
+def remove_archive(bind):
+    """Delete the archive (partitions and CUTOFF) of the database behind `bind`.
+
+    Call it before dropping or emptying that database's tables: in that order a
+    failure can leave a database without its archive, but never an archive
+    whose customer ids a fresh database reuses. Subdirectories of other shards
+    are left alone.
+    """
+    archive_dir = archive_dir_for(bind)
+    if not os.path.isdir(archive_dir):
+        return
+    cutoff = os.path.join(archive_dir, "CUTOFF")
+    if os.path.exists(cutoff):
+        os.remove(cutoff)  # first, so history() stops reading the partitions
+    for f in os.listdir(archive_dir):
+        if f.startswith("transactions_"):
+            os.remove(os.path.join(archive_dir, f))
+
+
+def archive_old(horizon_days=HORIZON_DAYS, archive_dir=None, bind=None):
+    """Move transactions older than `horizon_days` (rounded down to a month start) to the archive.
+
+    Partitions are written first, then one database transaction deletes the
+    archived rows and leaves one carry_forward row per customer holding their net,
+    so balance replays over the hot table still start from the right amount.
+    Partitions go to `archive_dir`, by default the database's own
+    (archive_dir_for). Returns the number of rows archived.
+    """
+    bind = bind if bind is not None else engine
+    archive_dir = archive_dir or archive_dir_for(bind)
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = (utcnow() - timedelta(days=horizon_days)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    with bind.connect() as conn:
+        # old carry_forward rows are folded in too, but alone they are no reason to run
+        max_id = conn.execute(
+            select(func.max(transactions.c.id)).where(transactions.c.timestamp < cutoff, transactions.c.type != CARRY)
+        ).scalar()
+    if max_id is None:
+        return 0
+
+    # 1) export, one month at a time
+    q = select(*[transactions.c[c] for c in COLUMNS]) \
+        .where(transactions.c.timestamp < cutoff, transactions.c.id <= max_id) \
+        .order_by(transactions.c.timestamp, transactions.c.id)
+    n, month, rows = 0, None, []
+    with bind.connect() as conn:
+        for r in conn.execution_options(stream_results=True).execute(q):
+            m = r.timestamp.strftime("%Y-%m")
+            if m != month and rows:
+                _write_partition(month, rows, archive_dir)
+                n += len(rows)
+                rows = []
+            month = m
+            rows.append(tuple(r))
+    if rows:
+        _write_partition(month, rows, archive_dir)
+        n += len(rows)
+
+    # 2) swap the archived rows for carry-forward rows
+    signed = case((transactions.c.type.in_(CREDIT_TYPES), transactions.c.amount), else_=-transactions.c.amount)
+    archived = (transactions.c.timestamp < cutoff) & (transactions.c.id <= max_id)
+    with bind.begin() as conn:
+        nets = conn.execute(
+            select(transactions.c.customer_id, func.sum(signed)).where(archived).group_by(transactions.c.customer_id)
+        ).all()
+        conn.execute(delete(transactions).where(archived))
+        carry_ts = cutoff - timedelta(microseconds=1)
+        carries = [{"customer_id": cid, "amount": net, "type": CARRY, "timestamp": carry_ts,
+                    "note": f"balance carried forward from before {cutoff:%Y-%m-%d}"}
+                   for cid, net in nets]
+        if carries:
+            conn.execute(insert(transactions), carries)
+
+    _set_cutoff(cutoff, archive_dir)
+    return n
+
+
+def _months(start, end):
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        yield f"{y:04d}-{m:02d}"
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def history(conn, customer_id, start=None, end=None, archive_dir=None):
+    """Transactions of one customer in [start, end), oldest first, as
+    (timestamp, type, amount, note) tuples.
+
+    Archive partitions are only opened when the range reaches back before the
+    archive cutoff; in that case the carry_forward rows are dropped, since the
+    archived detail they summarise is returned instead. `archive_dir` defaults
+    to the archive of the database `conn` is connected to.
+    """
+    archive_dir = archive_dir or archive_dir_for(conn)
+    rows = []
+    until = archived_until(archive_dir)
+    from_archive = until is not None and (start is None or start < until)
+    if from_archive:
+        first = start
+        if first is None:
+            names = _partitions(archive_dir)
+            first = np.datetime64(names[0]).astype("datetime64[us]").item() if names else until
+        last = min(end, until) if end is not None else until
+        lo = np.datetime64(start, "us") if start is not None else None
+        hi = np.datetime64(end, "us") if end is not None else None
+        for month in _months(first, last):
+            part = load_partition(month, archive_dir)
+            if part is None:
+                continue
+            cids = part["customer_id"]
+            a, b = np.searchsorted(cids, customer_id, "left"), np.searchsorted(cids, customer_id, "right")
+            ts = part["timestamp"][a:b]
+            keep = np.ones(b - a, dtype=bool)
+            if lo is not None:
+                keep &= ts >= lo
+            if hi is not None:
+                keep &= ts < hi
+            for i in np.nonzero(keep)[0] + a:
+                rows.append((part["timestamp"][i].item(), str(part["type"][i]), float(part["amount"][i]),
+                             str(part["note"][i]) or None))
+
+    q = select(transactions.c.timestamp, transactions.c.type, transactions.c.amount, transactions.c.note) \
+        .where(transactions.c.customer_id == customer_id).order_by(transactions.c.timestamp, transactions.c.id)
+    if start is not None:
+        q = q.where(transactions.c.timestamp >= start)
+    if end is not None:
+        q = q.where(transactions.c.timestamp < end)
+    rows += [tuple(r) for r in conn.execute(q)]
+    if from_archive:
+        rows = [r for r in rows if r[1] != CARRY]
+    return rows
+
+
+if __name__ == "__main__":
+    from shards import ShardRouter
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else HORIZON_DAYS
+    for eng in ShardRouter.load().all_engines():
+        print(f"archived {archive_old(days, bind=eng)} transactions older than {days} days "
+              f"into {archive_dir_for(eng)}/")
@@ -0,0 +1,368 @@
+# backup.py
+# Online backups of the live SQLite database, restores into new files, and point-in-time
+# restore from a base backup plus archived WAL frames.
+#   python backup.py backup DEST [PAGES]      -> consistent copy of DB_URL while it is in use
+#   python backup.py restore BACKUP DEST      -> restore a backup into a new file
+#   python backup.py archive [SECONDS]        -> keep a base backup and archive the WAL into
+#                                                WAL_ARCHIVE_DIR every SECONDS (default 1)
+#   python backup.py pitr DEST [TIME]         -> rebuild the database as of TIME (UTC, ISO format)
+#   python backup.py --bench [SECONDS]        -> writer commit latency with and without a backup
+import json
+import os
+import sqlite3
+import struct
+import sys
+import time
+from datetime import datetime
+from bank_db import engine, utcnow
+
+PAGES_PER_STEP = 256      # pages copied while the source is read-locked
+STEP_SLEEP = 0.005        # seconds between steps, when writers get the database to themselves
+MAX_RESTARTS = 3          # then finish in one pass instead of chasing the writers
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+WAL_ARCHIVE_DIR = os.getenv("WAL_ARCHIVE_DIR", "wal_archive")
+
+WAL_HEADER = 32
+FRAME_HEADER = 24
+
+
+class Restarted(Exception):
+    pass
+
+
+def db_path(bind=None):
+    bind = bind if bind is not None else engine
+    if bind.dialect.name != "sqlite" or not bind.url.database:
+        raise ValueError("backups need a file-backed SQLite database")
+    return bind.url.database
+
+
+def _connect(path, **kw):
+    return sqlite3.connect(path, isolation_level=None, check_same_thread=False, **kw)
+
+
+def _check(path):
+    with _connect(path) as conn:
+        ok = conn.execute("PRAGMA quick_check").fetchone()[0]
+    if ok != "ok":
+        raise ValueError(f"{path} failed its integrity check: {ok}")
+
+
+# ---------- ONLINE BACKUP ----------
+def backup(dest, src=None, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, max_restarts=MAX_RESTARTS):
+    """Copy the database at `src` (default DB_URL) to `dest` while it stays in use.
+
+    SQLite's backup API copies `pages` pages per step, holding a read lock
+    only during a step. A commit by another connection restarts the copy from
+    the first page; after `max_restarts` of those the rest is copied in one
+    pass from a single snapshot (which in WAL mode still lets writers commit).
+    The copy goes to a temporary file that replaces `dest` once it is complete
+    and checked. Returns a report: seconds, steps, pages, restarts, one_pass,
+    longest_step_ms and writer_stall_ms, the longest a writer could have
+    waited on the backup: the longest step with a rollback journal, nothing
+    in WAL mode, where readers never block the writer.
+    """
+    src = src or db_path()
+    tmp = dest + ".tmp"
+    report = {"seconds": 0.0, "steps": 0, "pages": 0, "restarts": 0, "one_pass": False,
+              "longest_step_ms": 0.0, "writer_stall_ms": 0.0}
+    state = {"remaining": None, "last": 0.0}
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        report["steps"] += 1
+        report["pages"] = total
+        report["longest_step_ms"] = max(report["longest_step_ms"], (now - state["last"]) * 1000)
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            report["restarts"] += 1
+            if report["restarts"] >= max_restarts:
+                raise Restarted()
+        state["remaining"] = remaining
+        state["last"] = now + sleep
+
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    t0 = state["last"] = time.perf_counter()
+    with _connect(src, timeout=30) as source:
+        target = _connect(tmp)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=progress, sleep=sleep)
+            except Restarted:
+                step = time.perf_counter()
+                source.backup(target)
+                report["one_pass"] = True
+                report["steps"] += 1
+                report["longest_step_ms"] = max(report["longest_step_ms"], (time.perf_counter() - step) * 1000)
+        finally:
+            target.close()
+        if source.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            report["writer_stall_ms"] = report["longest_step_ms"]
+    report["seconds"] = time.perf_counter() - t0
+    _check(tmp)
+    os.replace(tmp, dest)
+    return report
+
+
+def restore(src, dest):
+    """Copy the backup `src` into the new file `dest` (never over an existing file)."""
+    if os.path.exists(dest):
+        raise FileExistsError(f"{dest} exists; restore into a new file and swap it in while the app is stopped")
+    _check(src)
+    with _connect(src) as source:
+        target = _connect(dest)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    return dest
+
+
+# ---------- WAL ARCHIVING ----------
+def _read_wal(path):
+    """(page_size, salt, frames) for the committed frames of the current WAL generation.
+
+    frames is a list of (page_no, db_pages_after_commit_or_0, page_bytes). Frames
+    left over from an earlier generation have a different salt and end the scan,
+    as does anything after the last commit frame.
+    """
+    try:
+        with open(path, "rb") as fs:
+            data = fs.read()
+    except FileNotFoundError:
+        return None, None, []
+    if len(data) < WAL_HEADER:
+        return None, None, []
+    _, _, page_size, _, s1, s2 = struct.unpack(">6I", data[:24])
+    frames, committed, pos = [], 0, WAL_HEADER
+    while pos + FRAME_HEADER + page_size <= len(data):
+        pgno, size, f1, f2 = struct.unpack(">4I", data[pos:pos + 16])
+        if (f1, f2) != (s1, s2):
+            break
+        frames.append((pgno, size, data[pos + FRAME_HEADER:pos + FRAME_HEADER + page_size]))
+        if size:
+            committed = len(frames)
+        pos += FRAME_HEADER + page_size
+    return page_size, [s1, s2], frames[:committed]
+
+
+class WalArchiver:
+    """Keeps a base backup plus every WAL frame written since, in `archive_dir`.
+
+    Each round briefly takes the write lock, copies the frames committed since
+    the last round, then checkpoints them into the database before letting
+    writers go again. So the WAL only starts over (and overwrites frames)
+    after they are archived. Application connections must not checkpoint on
+    their own: bank_db turns autocheckpoint off when WAL_ARCHIVE_DIR is set.
+    If frames may have been lost anyway (first run, the archiver was down and
+    the last connection checkpointed on close), a new base backup starts a
+    new chain. The archiver's own connection stays open so that does not
+    happen while it runs.
+    """
+
+    def __init__(self, src=None, archive_dir=WAL_ARCHIVE_DIR):
+        self.src = src or db_path()
+        self.dir = archive_dir
+        os.makedirs(os.path.join(archive_dir, "base"), exist_ok=True)
+        os.makedirs(os.path.join(archive_dir, "wal"), exist_ok=True)
+        self.index = os.path.join(archive_dir, "index.jsonl")
+        entries = read_index(archive_dir)
+        last = entries[-1] if entries else {}
+        self.seq = last.get("seq", 0)
+        # where the previous run stopped; round() checks that the WAL still continues from there
+        self.salt = last.get("salt")
+        self.frames = last.get("from", 0) + last.get("frames", 0)
+        self.backfilled = last.get("backfilled", False)
+        self.chain = bool(entries) and self.salt is not None
+        self.conn = _connect(self.src, timeout=30)
+        self.conn.execute("PRAGMA wal_autocheckpoint=0")
+        self.conn.execute("SELECT count(*) FROM sqlite_master")  # opens the WAL
+
+    def _append(self, entry):
+        with open(self.index, "a") as fs:
+            fs.write(json.dumps(entry) + "\n")
+            fs.flush()
+            os.fsync(fs.fileno())
+
+    def base_backup(self):
+        self.seq += 1
+        seq = self.seq
+        # frames already in the WAL are in the base too; replaying them again is harmless
+        _, salt, frames = _read_wal(self.src + "-wal")
+        report = backup(os.path.join(self.dir, "base", f"{seq:08d}.db"), self.src)
+        self._append({"seq": seq, "kind": "base", "time": utcnow().isoformat(), "file": f"base/{seq:08d}.db",
+                      "salt": salt, "seconds": round(report["seconds"], 3)})
+        self.salt, self.frames, self.backfilled, self.chain = salt, 0, False, True
+        return report
+
+    def round(self):
+        """Archive new frames; returns (frames archived, milliseconds writers were held)."""
+        lock = _connect(self.src, timeout=30)
+        t0 = time.perf_counter()
+        try:
+            lock.execute("BEGIN IMMEDIATE")
+            page_size, salt, frames = _read_wal(self.src + "-wal")
+            if salt == self.salt:
+                start = self.frames
+                broken = len(frames) < start
+            else:
+                # the WAL started over: fine only if it is the next generation (salt-1 goes up
+                # by one) after one we checkpointed completely
+                start = 0
+                broken = not self.chain or self.salt is not None and not (
+                    self.backfilled and salt is not None and salt[0] == (self.salt[0] + 1) & 0xFFFFFFFF)
+            if broken:
+                lock.execute("ROLLBACK")
+                lock.close()
+                self.base_backup()
+                return self.round()
+            new = frames[start:]
+            if new:
+                name = f"wal/{self.seq + 1:08d}.wal"
+                with open(os.path.join(self.dir, name), "wb") as fs:
+                    for pgno, size, page in new:
+                        fs.write(struct.pack(">2I", pgno, size))
+                        fs.write(page)
+                    fs.flush()
+                    os.fsync(fs.fileno())
+            # checkpoint everything while writers are still held, so nothing unarchived is overwritten
+            _, log, done = self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            self.salt, self.frames, self.backfilled = salt, len(frames), log == done
+            if new:
+                self.seq += 1
+                self._append({"seq": self.seq, "kind": "wal", "time": utcnow().isoformat(), "file": name,
+                              "page_size": page_size, "salt": salt, "from": start, "frames": len(new),
+                              "backfilled": self.backfilled})
+            lock.execute("ROLLBACK")
+        finally:
+            lock.close()
+        return len(new), (time.perf_counter() - t0) * 1000
+
+    def run(self, interval=1.0):
+        while True:
+            started = time.monotonic()
+            n, held = self.round()
+            if n:
+                print(f"{utcnow():%Y-%m-%d %H:%M:%S} archived {n} frames, writers held {held:.1f} ms", flush=True)
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def close(self):
+        self.conn.close()
+
+
+def read_index(archive_dir=WAL_ARCHIVE_DIR):
+    path = os.path.join(archive_dir, "index.jsonl")
+    if not os.path.exists(path):
+        return []
+    with open(path) as fs:
+        return [json.loads(line) for line in fs if line.strip()]
+
+
+def restore_to(dest, until=None, archive_dir=WAL_ARCHIVE_DIR):
+    """Rebuild the database as of `until` (naive UTC datetime; default: latest) into `dest`.
+
+    Starts from the newest base backup taken at or before `until` and writes
+    the page images of every archived round after it up to `until`. The
+    result is the database as of the last archive round at or before
+    `until`, so its precision is the archiver's interval. Returns
+    (time restored to, number of rounds replayed).
+    """
+    entries = read_index(archive_dir)
+    cutoff = until.isoformat() if until else "9999"
+    bases = [e for e in entries if e["kind"] == "base" and e["time"] <= cutoff]
+    if not bases:
+        raise ValueError(f"no base backup in {archive_dir} at or before {until}")
+    base = bases[-1]
+    rounds = [e for e in entries if e["kind"] == "wal" and e["seq"] > base["seq"] and e["time"] <= cutoff]
+    restore(os.path.join(archive_dir, base["file"]), dest)
+
+    size = None
+    with open(dest, "r+b") as db:
+        for e in rounds:
+            page_size = e["page_size"]
+            with open(os.path.join(archive_dir, e["file"]), "rb") as fs:
+                data = fs.read()
+            step = 8 + page_size
+            for pos in range(0, len(data), step):
+                pgno, commit = struct.unpack(">2I", data[pos:pos + 8])
+                db.seek((pgno - 1) * page_size)
+                db.write(data[pos + 8:pos + step])
+                if commit:
+                    size = commit * page_size
+        if size is not None:
+            db.truncate(size)
+        db.flush()
+        os.fsync(db.fileno())
+    _check(dest)
+    return (rounds[-1] if rounds else base)["time"], len(rounds)
+
+
+# ---------- BENCHMARK ----------
+def _bench(seconds=2.0, rows=300000):
+    import tempfile, threading
+    from statistics import quantiles
+
+    d = tempfile.mkdtemp()
+    for journal in ("wal", "delete"):
+        path = os.path.join(d, f"bench-{journal}.db")
+        with _connect(path) as conn:
+            conn.execute(f"PRAGMA journal_mode={journal}")
+            conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, amount REAL, note TEXT)")
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO t (amount, note) VALUES (?, ?)", ((i, "x" * 100) for i in range(rows)))
+            conn.execute("COMMIT")
+
+        def measure(work):
+            stop, lat = threading.Event(), []
+
+            def writer():
+                w = _connect(path, timeout=30)
+                w.execute("PRAGMA synchronous=NORMAL")
+                while not stop.is_set():
+                    t = time.perf_counter()
+                    w.execute("INSERT INTO t (amount, note) VALUES (1, 'w')")
+                    lat.append(time.perf_counter() - t)
+                    time.sleep(0.002)
+                w.close()
+            th = threading.Thread(target=writer)
+            th.start()
+            res = work()
+            stop.set()
+            th.join()
+            q = quantiles(lat, n=100, method="inclusive")
+            return res, f"p50 {q[49] * 1000:6.2f} ms  p99 {q[98] * 1000:6.2f} ms  max {max(lat) * 1000:7.2f} ms"
+
+        _, lat = measure(lambda: time.sleep(seconds))
+        print(f"[{journal:<6}] no backup:               writer {lat}")
+        for pages in (PAGES_PER_STEP, -1):
+            rep, lat = measure(lambda: backup(os.path.join(d, "copy.db"), path, pages=pages))
+            label = f"{pages} pages/step:" if pages > 0 else "one step:"
+            print(f"[{journal:<6}] backup, {label:<16} writer {lat}")
+            print(f"{'':10}{rep['pages']} pages in {rep['seconds']:.2f}s, {rep['steps']} steps, "
+                  f"{rep['restarts']} restarts{' (finished in one pass)' if rep['one_pass'] else ''}, "
+                  f"longest step {rep['longest_step_ms']:.1f} ms, writer stall {rep['writer_stall_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["backup"] and len(args) in (2, 3):
+        rep = backup(args[1], pages=int(args[2]) if len(args) == 3 else PAGES_PER_STEP)
+        print(f"backed up {rep['pages']} pages to {args[1]} in {rep['seconds']:.2f}s ({rep['steps']} steps, "
+              f"{rep['restarts']} restarts{', finished in one pass' if rep['one_pass'] else ''}); "
+              f"longest step {rep['longest_step_ms']:.1f} ms, writer stall {rep['writer_stall_ms']:.1f} ms")
+    elif args[:1] == ["restore"] and len(args) == 3:
+        print(f"restored {args[1]} into {restore(args[1], args[2])}")
+    elif args[:1] == ["archive"] and len(args) <= 2:
+        archiver = WalArchiver()
+        try:
+            archiver.run(float(args[1]) if len(args) == 2 else 1.0)
+        except KeyboardInterrupt:
+            archiver.close()
+    elif args[:1] == ["pitr"] and len(args) in (2, 3):
+        when, n = restore_to(args[1], datetime.fromisoformat(args[2]) if len(args) == 3 else None)
+        print(f"restored {args[1]} as of {when} ({n} archived rounds replayed)")
+    elif args[:1] == ["--bench"]:
+        _bench(float(args[1]) if len(args) > 1 else 2.0)
+    else:
+        print("usage: python backup.py backup DEST [PAGES] | restore BACKUP DEST | archive [SECONDS] | "
+              "pitr DEST [TIME] | --bench [SECONDS]")
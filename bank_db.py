@@ -0,0 +1,522 @@
+# bank_db.py
+# Database config, models and helpers shared by the Streamlit app and the batch jobs.
+import os
+import json
+import random
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy import (
+    create_engine, event, inspect, select, update, insert, bindparam,
+    Column, Integer, String, Float, DateTime, ForeignKey, Index, UniqueConstraint, case, func, literal_column
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm.exc import StaleDataError
+import bcrypt
+from dotenv import load_dotenv
+
+load_dotenv()  # read database URL from .env in production
+
+# ---------- CONFIG ----------
+DB_URL = os.getenv("DB_URL", "sqlite:///./bank.db")  # swap to Postgres in prod
+Base = declarative_base()
+
+def make_engine(url):
+    eng = create_engine(url, connect_args={"check_same_thread": False} if "sqlite" in url else {})
+    if eng.dialect.name == "sqlite":
+        @event.listens_for(eng, "connect")
+        def _sqlite_pragmas(dbapi_conn, _):
+            # WAL lets readers run alongside the writer; NORMAL sync is still crash-safe in WAL
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            if os.getenv("WAL_ARCHIVE_DIR"):
+                # backup.py's archiver checkpoints after copying the WAL; ours could overwrite unarchived frames
+                cur.execute("PRAGMA wal_autocheckpoint=0")
+            cur.close()
+    return eng
+
+engine = make_engine(DB_URL)
+SessionLocal = sessionmaker(bind=engine)
+
+def db_label(bind):
+    # "" for DB_URL's database; for any other (a shard, see shards.py) a short name from its URL,
+    # for files kept per database, since customer and transaction ids are only unique within one
+    url = bind.engine.url
+    if url == make_url(DB_URL):
+        return ""
+    name = os.path.splitext(os.path.basename(url.database or ""))[0] or url.get_backend_name()
+    return f"{name}-{zlib.crc32(url.render_as_string().encode()):08x}"
+
+# ---------- MODELS ----------
+class Customer(Base):
+    __tablename__ = "customers"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    age = Column(Integer, nullable=False)
+    email = Column(String, nullable=False, unique=True)
+    mob_no = Column(String, nullable=True)
+    account_no = Column(String, nullable=False, unique=True, index=True)
+    pin_hash = Column(String, nullable=False)
+    balance = Column(Float, default=0.0)
+    account_type = Column(String, nullable=True, default="savings")  # see limits.DAILY_LIMITS
+    hot_slots = Column(Integer, nullable=True)  # hot account: credits go to this many balance_slots (see hot.py)
+    hot_folded_tx = Column(Integer, nullable=True)  # hot account: postings up to this transaction id are folded
+    created_at = Column(DateTime, default=func.now())
+    transactions = relationship("Transaction", back_populates="customer", cascade="all, delete-orphan")
+
+class Transaction(Base):
+    __tablename__ = "transactions"
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"))
+    amount = Column(Float, nullable=False)
+    type = Column(String, nullable=False)  # deposit, withdraw, transfer_in, transfer_out, interest, fee
+    timestamp = Column(DateTime, default=func.now())
+    note = Column(String, nullable=True)
+    ref = Column(String, nullable=True)  # shared by both legs of a transfer
+    customer = relationship("Customer", back_populates="transactions")
+    __table_args__ = (Index("ix_transactions_customer_time", "customer_id", "timestamp"),)
+
+class MonthlySummary(Base):
+    # one row per customer per month with activity; kept up to date by record_postings()
+    __tablename__ = "monthly_summary"
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    month = Column(String, nullable=False)  # "YYYY-MM" (UTC)
+    opening = Column(Float, nullable=False, default=0.0)
+    credits = Column(Float, nullable=False, default=0.0)
+    debits = Column(Float, nullable=False, default=0.0)
+    closing = Column(Float, nullable=False, default=0.0)
+    postings = Column(Integer, nullable=True, default=0)
+    __table_args__ = (UniqueConstraint("customer_id", "month", name="uq_monthly_summary"),)
+
+class BalanceCheckpoint(Base):
+    # balance including every transaction with timestamp <= as_of (see checkpoints.py)
+    __tablename__ = "balance_checkpoints"
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    as_of = Column(DateTime, nullable=False)
+    balance = Column(Float, nullable=False)
+    __table_args__ = (Index("ix_balance_checkpoints_customer_as_of", "customer_id", "as_of"),)
+
+class DailyTotal(Base):
+    # today's posted totals per customer; a row left over from an earlier day counts as zero
+    __tablename__ = "daily_totals"
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    day = Column(String, nullable=False)  # "YYYY-MM-DD" (UTC)
+    deposited = Column(Float, nullable=False, default=0.0)
+    withdrawn = Column(Float, nullable=False, default=0.0)
+
+class BalanceSlot(Base):
+    # credits to a hot account not yet folded into customers.balance (see hot.py)
+    __tablename__ = "balance_slots"
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    amount = Column(Float, nullable=False, default=0.0)
+
+class AccrualRun(Base):
+    # progress of the interest/fee accrual for one date (see interest.py)
+    __tablename__ = "accrual_runs"
+    day = Column(String, primary_key=True)  # "YYYY-MM-DD" (UTC)
+    last_customer_id = Column(Integer, nullable=False, default=0)  # accounts up to here are posted
+    accounts = Column(Integer, nullable=False, default=0)
+    finished_at = Column(DateTime, nullable=True)
+
+class IdempotencyKey(Base):
+    # one row per accepted deposit/withdraw submission (see idempotency.py)
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)  # the unique constraint that stops double posting
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    result = Column(String, nullable=True)  # JSON of the original outcome
+    __table_args__ = (Index("ix_idempotency_keys_created_at", "created_at"),)
+
+class OutboxEvent(Base):
+    # change feed, written in the same transaction as the change it describes (see changefeed.py)
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True)  # feed offset; AUTOINCREMENT so ids of pruned rows are never reused
+    topic = Column(String, nullable=False)  # "transaction" or "customer"
+    customer_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    payload = Column(String, nullable=False)  # JSON
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class ConsumerOffset(Base):
+    # last outbox id each named consumer has acknowledged
+    __tablename__ = "consumer_offsets"
+    name = Column(String, primary_key=True)
+    acked = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+# everything else debits the balance; carry_forward amounts are signed (see archive.py)
+CREDIT_TYPES = ("deposit", "transfer_in", "carry_forward", "interest")
+# customer-initiated debits, counted against the daily withdrawal limit (fees are not)
+DEBIT_TYPES = ("withdraw", "transfer_out")
+CHECKPOINT_EVERY = 100  # postings per customer (counted per month) between balance checkpoints
+
+_slots = BalanceSlot.__table__
+# the exact balance: customers.balance plus hot-account credits still waiting in their slots
+current_balance = Customer.__table__.c.balance + func.coalesce(
+    select(func.sum(_slots.c.amount)).where(_slots.c.customer_id == Customer.__table__.c.id).scalar_subquery(),
+    literal_column("0.0"),
+)
+
+def init_db(bind):
+    Base.metadata.create_all(bind=bind)
+    # create_all() never alters existing tables; add new (nullable) columns in place
+    insp = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in have:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(bind.dialect)}"
+                    )
+            for idx in table.indexes:
+                idx.create(conn, checkfirst=True)
+
+init_db(engine)
+
+# ---------- POSTINGS ----------
+_compiled = {}
+
+def executemany(conn, stmt, params):
+    # Skip per-row Core parameter processing: compile once per dialect and
+    # hand plain tuples/dicts straight to the driver's executemany().
+    # Values that need a bind processor (datetimes on SQLite) are converted in
+    # place, once per distinct value.
+    key = (stmt, conn.dialect.name)
+    if key not in _compiled:
+        dialect = conn.dialect
+        if dialect.name == "sqlite":
+            # sqlite3 binds dicts natively with :name placeholders
+            dialect = type(dialect)(paramstyle="named")
+        c = stmt.compile(dialect=dialect)
+        procs = {}
+        for name, bp in c.binds.items():
+            proc = bp.type.bind_processor(conn.dialect)
+            if proc is not None:
+                procs[name] = proc
+        _compiled[key] = (c.string, c.positiontup, procs)
+    sql, order, procs = _compiled[key]
+    for name, proc in procs.items():
+        done = {}
+        for p in params:
+            v = p[name]
+            if v not in done:
+                done[v] = proc(v)
+            p[name] = done[v]
+    if order:
+        params = [tuple(p[k] for k in order) for p in params]
+    return conn.exec_driver_sql(sql, params)
+
+def utcnow():
+    # transaction timestamps are naive UTC, same as SQLite's CURRENT_TIMESTAMP
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+summaries = MonthlySummary.__table__
+_bump_summary = (
+    update(summaries)
+    .where(summaries.c.customer_id == bindparam("p_cid"), summaries.c.month == bindparam("p_month"))
+    .values(
+        credits=summaries.c.credits + bindparam("p_cr"),
+        debits=summaries.c.debits + bindparam("p_dr"),
+        closing=summaries.c.closing + bindparam("p_cr") - bindparam("p_dr"),
+        postings=func.coalesce(summaries.c.postings, literal_column("0")) + bindparam("p_n"),
+    )
+)
+_new_summary = insert(summaries).values(
+    customer_id=bindparam("p_cid"), month=bindparam("p_month"), opening=bindparam("p_open"),
+    credits=bindparam("p_cr"), debits=bindparam("p_dr"), closing=bindparam("p_close"), postings=bindparam("p_n"),
+)
+_new_checkpoint = insert(BalanceCheckpoint.__table__).values(
+    customer_id=bindparam("p_cid"), as_of=bindparam("p_ts"), balance=bindparam("p_bal"),
+)
+
+_find_summaries = select(summaries.c.customer_id, summaries.c.month, summaries.c.postings).where(
+    summaries.c.customer_id.in_(bindparam("ids", expanding=True)),
+    summaries.c.month.in_(bindparam("months", expanding=True)),
+)
+# the folded balance, which matches the postings recorded so far for hot accounts too
+_find_balances = select(Customer.__table__.c.id, Customer.__table__.c.balance, Customer.__table__.c.hot_slots) \
+    .where(Customer.__table__.c.id.in_(bindparam("ids", expanding=True)))
+
+def record_postings(conn, txs):
+    """Update the tables derived from postings, in the caller's transaction.
+
+    `txs` are the just-inserted transactions as dicts with customer_id, amount,
+    type and timestamp (note and ref are passed on to the outbox when present).
+    Call it after the customers' balances have been updated. For hot accounts
+    the summaries, checkpoints and deposit totals are left to the fold job,
+    which calls record_folded(); only the outbox event is written here.
+    """
+    if not isinstance(txs, list):
+        txs = list(txs)
+    hot = _record_monthly(conn, txs)
+    _record_daily(conn, txs, hot)
+    _record_outbox(conn, txs)
+
+def record_folded(conn, txs):
+    """The part of record_postings() skipped for a hot account's postings (see hot.py).
+
+    Call it in the fold's transaction, after the slots have been added to
+    customers.balance, with every posting since the last fold.
+    """
+    _record_monthly(conn, txs, folding=True)
+    _record_daily(conn, [t for t in txs if t["type"] == "deposit"])
+
+def _record_monthly(conn, txs, folding=False):
+    agg, month_of, last_ts = {}, {}, {}
+    for t in txs:
+        ts = t["timestamp"]
+        m = month_of.get(ts)
+        if m is None:
+            m = month_of[ts] = ts.strftime("%Y-%m")
+        key = (t["customer_id"], m)
+        cr_dr_n = agg.setdefault(key, [0.0, 0.0, 0])
+        cr_dr_n[0 if t["type"] in CREDIT_TYPES else 1] += t["amount"]
+        cr_dr_n[2] += 1
+        if ts > last_ts.get(t["customer_id"], ts.min):
+            last_ts[t["customer_id"]] = ts
+    if not agg:
+        return set()
+
+    cids = list({cid for cid, _ in agg})
+    months = list({m for _, m in agg})
+    have, balances, hot = {}, {}, set()
+    for part in range(0, len(cids), 900):
+        ids = cids[part:part + 900]
+        for cid, m, n in conn.execute(_find_summaries, {"ids": ids, "months": months}):
+            have[(cid, m)] = n or 0
+        for cid, bal, slots in conn.execute(_find_balances, {"ids": ids}):
+            balances[cid] = bal
+            if slots and not folding:
+                hot.add(cid)
+    if hot:
+        agg = {key: v for key, v in agg.items() if key[0] not in hot}
+
+    bumps, new, checkpoint = [], [], set()
+    net = {}
+    for (cid, m), (cr, dr, n) in agg.items():
+        net[cid] = net.get(cid, 0.0) + cr - dr
+    for (cid, m), (cr, dr, n) in sorted(agg.items()):
+        if (cid, m) in have:
+            before = have[(cid, m)]
+            bumps.append({"p_cid": cid, "p_month": m, "p_cr": cr, "p_dr": dr, "p_n": n})
+        else:
+            # first activity this month: opening is the balance before this batch
+            before = 0
+            opening = (balances.get(cid) or 0.0) - net[cid]
+            new.append({"p_cid": cid, "p_month": m, "p_open": opening, "p_cr": cr, "p_dr": dr,
+                        "p_close": opening + cr - dr, "p_n": n})
+        net[cid] -= cr - dr
+        if (before + n) // CHECKPOINT_EVERY > before // CHECKPOINT_EVERY:
+            checkpoint.add(cid)
+    if bumps:
+        executemany(conn, _bump_summary, bumps)
+    if new:
+        executemany(conn, _new_summary, new)
+    if checkpoint:
+        executemany(conn, _new_checkpoint, [
+            {"p_cid": cid, "p_ts": last_ts[cid], "p_bal": balances.get(cid) or 0.0} for cid in sorted(checkpoint)
+        ])
+    return hot
+
+daily = DailyTotal.__table__
+_find_daily = select(daily.c.customer_id).where(daily.c.customer_id.in_(bindparam("ids", expanding=True)))
+# lazy day rollover: totals from an older day are dropped on the first posting of a new one.
+# Postings from a day older than the stored one (hot-account deposits folded after midnight)
+# match nothing: only the latest day's totals are kept, so they are no longer needed.
+_bump_daily = (
+    update(daily)
+    .where(daily.c.customer_id == bindparam("p_cid"), daily.c.day <= bindparam("p_day"))
+    .values(
+        deposited=case((daily.c.day == bindparam("p_day"), daily.c.deposited), else_=literal_column("0")) + bindparam("p_dep"),
+        withdrawn=case((daily.c.day == bindparam("p_day"), daily.c.withdrawn), else_=literal_column("0")) + bindparam("p_wd"),
+        day=bindparam("p_day"),
+    )
+)
+_new_daily = insert(daily).values(
+    customer_id=bindparam("p_cid"), day=bindparam("p_day"), deposited=bindparam("p_dep"), withdrawn=bindparam("p_wd"),
+)
+
+def _record_daily(conn, txs, hot=()):
+    agg, day_of = {}, {}
+    for t in txs:
+        if t["type"] == "deposit" and t["customer_id"] in hot:
+            continue  # counted when the fold job records it
+        ts = t["timestamp"]
+        d = day_of.get(ts)
+        if d is None:
+            d = day_of[ts] = ts.strftime("%Y-%m-%d")
+        key = (t["customer_id"], d)
+        dep_wd = agg.setdefault(key, [0.0, 0.0])
+        if t["type"] == "deposit":
+            dep_wd[0] += t["amount"]
+        elif t["type"] in DEBIT_TYPES:
+            dep_wd[1] += t["amount"]
+    if not agg:
+        return
+    cids = list({cid for cid, _ in agg})
+    have = set()
+    for part in range(0, len(cids), 900):
+        have.update(conn.execute(_find_daily, {"ids": cids[part:part + 900]}).scalars())
+    new, bumps = [], []
+    for (cid, d), (dep, wd) in sorted(agg.items()):
+        row = {"p_cid": cid, "p_day": d, "p_dep": dep, "p_wd": wd}
+        if cid in have:
+            bumps.append(row)
+        else:
+            new.append(row)
+            have.add(cid)  # a second day in the same batch becomes an update
+    if new:
+        executemany(conn, _new_daily, new)
+    if bumps:
+        executemany(conn, _bump_daily, bumps)
+
+def daily_totals(conn, customer_id, day=None):
+    """(deposited, withdrawn) for `customer_id` on `day` (default today, UTC): one primary-key read."""
+    day = day or utcnow().strftime("%Y-%m-%d")
+    row = conn.execute(
+        select(daily.c.day, daily.c.deposited, daily.c.withdrawn).where(daily.c.customer_id == customer_id)
+    ).first()
+    if row is None or row.day != day:
+        return 0.0, 0.0
+    return row.deposited, row.withdrawn
+
+def post_transaction(db, user, amount, kind, note=None):
+    # single deposit/withdraw through an ORM session; commits and refreshes `user`
+    tx = stage_transaction(db, user, amount, kind, note)
+    db.commit(); db.refresh(user)
+    return tx
+
+def stage_transaction(db, user, amount, kind, note=None):
+    # post_transaction() without the commit, for callers that add to the same transaction
+    amount = float(amount)
+    if user.hot_slots:
+        post_hot(db.connection(), user.id, user.hot_slots, amount, kind)
+    else:
+        # computed and checked in SQL, so postings from other sessions since `user` was loaded
+        # are neither lost nor overdrawn; raises InsufficientFunds
+        post_balance(db.connection(), user.id, amount, kind)
+        db.expire(user, ["balance"])
+    tx = Transaction(customer_id=user.id, amount=amount, type=kind, note=note, timestamp=utcnow())
+    db.add(tx); db.flush()
+    record_postings(db.connection(), [{"customer_id": user.id, "amount": amount, "type": kind, "timestamp": tx.timestamp,
+                                       "note": note}])
+    return tx
+
+# ---------- HOT ACCOUNTS ----------
+class InsufficientFunds(ValueError):
+    pass
+
+_credit_slot = (
+    update(_slots)
+    .where(_slots.c.customer_id == bindparam("p_cid"), _slots.c.slot == bindparam("p_slot"))
+    .values(amount=_slots.c.amount + bindparam("p_amount"))
+)
+
+def post_balance(conn, customer_id, amount, kind):
+    """Apply a posting to the customers row (the transaction row is the caller's).
+
+    A debit only goes through if the balance, hot-account slots included,
+    covers it; otherwise raises InsufficientFunds.
+    """
+    customers = Customer.__table__
+    if kind in CREDIT_TYPES:
+        if not conn.execute(update(customers).where(customers.c.id == customer_id)
+                            .values(balance=customers.c.balance + amount)).rowcount:
+            # moved to another shard (shards.split) since the caller looked
+            raise StaleDataError(f"customer {customer_id} is no longer in this database")
+    elif not conn.execute(update(customers).where(customers.c.id == customer_id, current_balance >= amount)
+                          .values(balance=customers.c.balance - amount)).rowcount:
+        raise InsufficientFunds("Insufficient funds.")
+
+def post_hot(conn, customer_id, n_slots, amount, kind):
+    """Apply a posting to a hot account's balance (the transaction row is the caller's).
+
+    A credit is added to one of the account's `n_slots` slots at random, so
+    concurrent credits rarely wait on each other. A debit updates the
+    customers row, which locks it, and only goes through if customers.balance
+    plus the slots covers it; otherwise raises InsufficientFunds.
+    """
+    if kind in CREDIT_TYPES and conn.execute(_credit_slot, {"p_cid": customer_id, "p_slot": random.randrange(n_slots),
+                                                            "p_amount": amount}).rowcount:
+        return
+    # a debit, or hot mode was switched off since the caller looked: the balance row instead
+    post_balance(conn, customer_id, amount, kind)
+
+def balance_of(conn, customer_id):
+    return conn.execute(select(current_balance).where(Customer.__table__.c.id == customer_id)).scalar()
+
+# ---------- OUTBOX ----------
+outbox = OutboxEvent.__table__
+_new_event = insert(outbox).values(
+    topic=bindparam("p_topic"), customer_id=bindparam("p_cid"), created_at=bindparam("p_ts"),
+    payload=bindparam("p_payload"),
+)
+CUSTOMER_FIELDS = ("name", "age", "email", "mob_no", "account_no", "account_type")
+
+def _record_outbox(conn, txs):
+    now = utcnow()
+    executemany(conn, _new_event, [
+        {"p_topic": "transaction", "p_cid": t["customer_id"], "p_ts": now, "p_payload": json.dumps({
+            "customer_id": t["customer_id"], "amount": t["amount"], "type": t["type"],
+            "timestamp": t["timestamp"].isoformat(), "note": t.get("note"), "ref": t.get("ref"),
+        })}
+        for t in txs
+    ])
+
+def _customer_events(session, _):
+    # created/updated/deleted customers flushed through an ORM session; balance-only
+    # changes are left out, they reach the feed as transactions
+    rows, now = [], utcnow()
+    for op, objs in (("created", session.new), ("updated", session.dirty), ("deleted", session.deleted)):
+        for obj in objs:
+            if not isinstance(obj, Customer):
+                continue
+            state = inspect(obj)
+            changed = [f for f in CUSTOMER_FIELDS + ("pin_hash",) if state.attrs[f].history.has_changes()]
+            if op == "updated" and not changed:
+                continue
+            payload = {"op": op, "id": obj.id, **{f: getattr(obj, f) for f in CUSTOMER_FIELDS}}
+            if op == "updated":
+                payload["changed"] = ["pin" if f == "pin_hash" else f for f in changed]
+            rows.append({"topic": "customer", "customer_id": obj.id, "created_at": now, "payload": json.dumps(payload)})
+    if rows:
+        session.connection().execute(insert(outbox), rows)
+
+def watch_customers(maker):
+    # customer events for every session `maker` creates (SessionLocal, per-shard sessionmakers)
+    event.listen(maker, "after_flush", _customer_events)
+    return maker
+
+watch_customers(SessionLocal)
+
+# ---------- HELPERS ----------
+def hash_pin(pin: str) -> str:
+    return bcrypt.hashpw(pin.encode(), bcrypt.gensalt()).decode()
+
+def verify_pin(pin: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(pin.encode(), hashed.encode())
+    except Exception:
+        return False
+
+def generate_acc_number():
+    import random, string
+    alpha = random.choices(string.ascii_uppercase, k=4)
+    nums = random.choices(string.digits, k=4)
+    special = random.choice("!@#$&%^*")
+    arr = alpha + nums + [special]
+    random.shuffle(arr)
+    return "".join(arr)
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,201 @@
+# bulk_post.py
+# Bulk posting of deposits/withdrawals (payroll and settlement files).
+#   python bulk_post.py postings.csv      -> post a CSV file against DB_URL
+#   python bulk_post.py --bench [N]       -> throughput benchmark on a scratch DB
+import csv
+import io
+import math
+import sys
+from itertools import islice
+from sqlalchemy import select, update, insert, bindparam, text
+from bank_db import engine, Customer, Transaction, current_balance, executemany, record_postings, utcnow
+
+POSTING_TYPES = ("deposit", "withdraw")
+CHUNK_SIZE = 50000
+MOVED = "account moved to another database while posting; not posted, resubmit"
+
+customers = Customer.__table__
+transactions = Transaction.__table__
+
+# built once, executed with a list of params (executemany)
+_apply_delta = (
+    update(customers)
+    .where(customers.c.id == bindparam("p_cid"))
+    .values(balance=customers.c.balance + bindparam("p_delta"))
+)
+# current_balance counts hot-account slots (hot.py) towards what a withdrawal may take
+_find_accounts = select(customers.c.account_no, customers.c.id, current_balance) \
+    .where(customers.c.account_no.in_(bindparam("accs", expanding=True))).order_by(customers.c.id)
+_lock_accounts = _find_accounts.with_for_update(of=customers)
+_write_lock = text("UPDATE customers SET id = id WHERE 0")  # SQLite: takes the database write lock
+_insert_tx = insert(transactions).values(
+    customer_id=bindparam("p_cid"), amount=bindparam("p_amount"), type=bindparam("p_type"),
+    note=bindparam("p_note"), timestamp=bindparam("p_ts"),
+)
+
+
+def read_postings_csv(source):
+    """Yield (account_no, amount, type, note) rows from a path or text/binary file.
+
+    A header row (account_no,amount,type,note) is skipped if present.
+    """
+    if isinstance(source, str):
+        with open(source, newline="") as fs:
+            yield from read_postings_csv(fs)
+        return
+    if isinstance(source, io.IOBase) and not isinstance(source, io.TextIOBase):
+        source = io.TextIOWrapper(source, encoding="utf-8", newline="")
+    for i, rec in enumerate(csv.reader(source)):
+        if not rec:
+            continue
+        if i == 0 and rec[0].strip().lower() == "account_no":
+            continue
+        rec += [""] * (4 - len(rec))
+        yield rec[0].strip(), rec[1].strip(), rec[2].strip().lower(), rec[3].strip() or None
+
+
+def _check_row(row):
+    # returns (account_no, amount, type, note) or an error string
+    try:
+        acc, amount, kind, note = row
+    except (TypeError, ValueError):
+        return "expected (account_no, amount, type, note)"
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        return f"invalid amount {amount!r}"
+    if not math.isfinite(amount) or amount <= 0:
+        return f"amount must be positive, got {amount}"
+    if kind not in POSTING_TYPES:
+        return f"unknown type {kind!r}"
+    if not acc:
+        return "missing account number"
+    return acc, amount, kind, note or None
+
+
+class _AccountsMoved(Exception):
+    # raised inside the chunk's transaction, so nothing from the chunk is committed
+    def __init__(self, taken):
+        self.taken = taken
+
+
+def _post_chunk(conn, chunk, start, rejected):
+    rows = []
+    for n, row in enumerate(chunk, start):
+        checked = _check_row(row)
+        if isinstance(checked, str):
+            rejected.append((n, row, checked))
+        else:
+            rows.append((n, checked))
+    if not rows:
+        return 0
+
+    # one set-based lookup for every account in the chunk, under the write lock (row locks
+    # elsewhere), so no other posting can change a balance between the overdraft check and the update
+    if conn.dialect.name == "sqlite":
+        conn.execute(_write_lock)
+        lookup = _find_accounts
+    else:
+        lookup = _lock_accounts
+    acc_nos = list({r[0] for _, r in rows})
+    found = {}
+    for part in range(0, len(acc_nos), 900):
+        for acc, cid, bal in conn.execute(lookup, {"accs": acc_nos[part:part + 900]}):
+            found[acc] = [cid, bal or 0.0]
+
+    deltas = {}
+    txs, taken = [], []
+    now = utcnow()
+    for n, (acc, amount, kind, note) in rows:
+        hit = found.get(acc)
+        if hit is None:
+            rejected.append((n, (acc, amount, kind, note), "account not found"))
+            continue
+        cid, bal = hit
+        if kind == "withdraw":
+            if amount > bal:
+                rejected.append((n, (acc, amount, kind, note), "insufficient funds"))
+                continue
+            hit[1] = bal - amount
+            deltas[cid] = deltas.get(cid, 0.0) - amount
+        else:
+            hit[1] = bal + amount
+            deltas[cid] = deltas.get(cid, 0.0) + amount
+        txs.append({"p_cid": cid, "p_amount": amount, "p_type": kind, "p_note": note, "p_ts": now})
+        taken.append((n, (acc, amount, kind, note)))
+
+    if txs:
+        applied = executemany(conn, _apply_delta, [{"p_cid": cid, "p_delta": d} for cid, d in deltas.items()])
+        if applied.rowcount != len(deltas) and conn.dialect.supports_sane_multi_rowcount:
+            # an account was deleted after the lookup (moved by shards.split); don't post
+            # transactions whose balance update matched nothing
+            raise _AccountsMoved(taken)
+        executemany(conn, _insert_tx, txs)
+        record_postings(conn, [
+            {"customer_id": t["p_cid"], "amount": t["p_amount"], "type": t["p_type"], "timestamp": now,
+             "note": t["p_note"]}
+            for t in txs
+        ])
+    return len(txs)
+
+
+def post_bulk(rows, chunk_size=CHUNK_SIZE, bind=None):
+    """Apply an iterable of (account_no, amount, type, note) postings.
+
+    Rows are applied in chunks, each chunk in its own database transaction.
+    Bad rows (unknown account, bad amount/type, overdraft) are rejected one by
+    one and never abort the batch. If an account leaves the database while its
+    chunk is posting (a shard split), the chunk is rolled back and its rows are
+    rejected with reason MOVED. Row numbers in the result are 1-based.
+    Returns {"posted": int, "rejected": [(row_no, row, reason), ...]}.
+    """
+    bind = bind if bind is not None else engine
+    it = iter(rows)
+    posted, rejected, start = 0, [], 1
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            break
+        done = []
+        try:
+            with bind.begin() as conn:
+                posted += _post_chunk(conn, chunk, start, done)
+        except _AccountsMoved as moved:
+            done += [(n, row, MOVED) for n, row in moved.taken]
+        rejected += done
+        start += len(chunk)
+    rejected.sort(key=lambda r: r[0])
+    return {"posted": posted, "rejected": rejected}
+
+
+def _bench(n_postings=200000, n_accounts=10000):
+    import os, random, tempfile, time
+    from bank_db import Base, make_engine
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    eng = make_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=eng)
+    accs = [f"B{i:08d}" for i in range(n_accounts)]
+    with eng.begin() as conn:
+        conn.execute(insert(customers), [
+            {"name": a, "age": 30, "email": f"{a}@bench", "account_no": a, "pin_hash": "x", "balance": 0.0}
+            for a in accs
+        ])
+    rows = [(random.choice(accs), random.randint(1, 500), "deposit", "payroll") for _ in range(n_postings)]
+    t0 = time.perf_counter()
+    res = post_bulk(rows, bind=eng)
+    dt = time.perf_counter() - t0
+    print(f"posted {res['posted']} rows ({len(res['rejected'])} rejected) in {dt:.2f}s "
+          f"-> {res['posted'] / dt:,.0f} postings/sec")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        _bench(int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
+    elif len(sys.argv) > 1:
+        res = post_bulk(read_postings_csv(sys.argv[1]))
+        print(f"posted: {res['posted']}")
+        for n, row, reason in res["rejected"]:
+            print(f"row {n} rejected: {reason} {row}")
+    else:
+        print("usage: python bulk_post.py postings.csv | --bench [N]")
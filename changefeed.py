@@ -0,0 +1,168 @@
+# changefeed.py
+# Change feed over the outbox table. Every posting (record_postings) and every customer
+# created/updated/deleted through an ORM session adds an event in the same transaction,
+# so consumers tail new activity by offset instead of re-reading `transactions`.
+# Each shard has its own outbox and offsets; the command line covers every shard in the map.
+#   python changefeed.py tail NAME   -> print new events as JSON lines, acknowledging as it goes
+#   python changefeed.py status      -> consumers, their offsets and lag
+#   python changefeed.py prune       -> delete events every consumer has acknowledged
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+from sqlalchemy import select, update, insert, delete, func
+from bank_db import engine, OutboxEvent, ConsumerOffset, utcnow
+
+outbox = OutboxEvent.__table__
+offsets = ConsumerOffset.__table__
+BATCH = 1000
+GAP_WAIT = float(os.getenv("CHANGEFEED_GAP_WAIT", "10"))  # seconds a missing id may still be committing
+
+
+def since(conn, offset, limit=BATCH):
+    """Up to `limit` events with id > `offset`, oldest first, as
+    (id, topic, customer_id, created_at, payload) with the payload decoded.
+
+    A primary-key range scan: the cost depends on the number of new events,
+    not on the size of the feed. SQLite commits one writer at a time, so ids
+    become visible in order and an offset never skips a late commit. Other
+    databases take ids from a sequence at insert time and may commit them out
+    of order, so there the batch stops at the first missing id (see _settled).
+    """
+    q = select(outbox.c.id, outbox.c.topic, outbox.c.customer_id, outbox.c.created_at, outbox.c.payload) \
+        .where(outbox.c.id > offset).order_by(outbox.c.id).limit(limit)
+    rows = conn.execute(q).all()
+    if conn.dialect.name != "sqlite":
+        rows = _settled(rows, offset)
+    return [(i, topic, cid, ts, json.loads(payload)) for i, topic, cid, ts, payload in rows]
+
+
+def _settled(rows, offset):
+    # rows up to the first hole in the ids that an open transaction may still fill. The
+    # transaction holding a missing id took it before the next row was written, so once that
+    # row is GAP_WAIT seconds old the hole is taken to be a rollback and passed over.
+    old = utcnow() - timedelta(seconds=GAP_WAIT)
+    for n, row in enumerate(rows):
+        if row[0] != offset + 1 and row[3] > old:
+            return rows[:n]
+        offset = row[0]
+    return rows
+
+
+def head(conn):
+    return conn.execute(select(func.max(outbox.c.id))).scalar() or 0
+
+
+class Consumer:
+    """A named reader of the feed whose acknowledged offset is stored in consumer_offsets.
+
+    A new consumer starts at the oldest retained event (`start="earliest"`) or
+    at the current end of the feed (`start="latest"`). Delivery is at least
+    once: events after the last ack() are delivered again after a restart.
+    """
+
+    def __init__(self, name, topics=None, start="earliest", batch=BATCH, bind=None):
+        self.name = name
+        self.topics = set(topics) if topics else None
+        self.batch = batch
+        self.bind = bind if bind is not None else engine
+        with self.bind.begin() as conn:
+            acked = conn.execute(select(offsets.c.acked).where(offsets.c.name == name)).scalar()
+            if acked is None:
+                acked = head(conn) if start == "latest" else 0
+                conn.execute(insert(offsets).values(name=name, acked=acked, updated_at=utcnow()))
+        self.offset = acked  # last id handed out by poll()
+
+    def poll(self):
+        """The next batch of events after the last polled one (filtered by topic)."""
+        with self.bind.connect() as conn:
+            events = since(conn, self.offset, self.batch)
+        if events:
+            # skipped topics still move the offset on
+            self.offset = events[-1][0]
+        if self.topics is not None:
+            events = [e for e in events if e[1] in self.topics]
+        return events
+
+    def ack(self, offset=None):
+        """Record that every event up to `offset` (default: the last polled) is processed."""
+        offset = self.offset if offset is None else offset
+        with self.bind.begin() as conn:
+            conn.execute(update(offsets).where(offsets.c.name == self.name, offsets.c.acked < offset)
+                         .values(acked=offset, updated_at=utcnow()))
+
+    def tail(self, idle=1.0):
+        """Yield events forever, acknowledging each batch once the caller asks for the next one."""
+        while True:
+            before = self.offset
+            yield from self.poll()
+            if self.offset == before:
+                time.sleep(idle)
+            else:
+                self.ack()
+
+
+def prune(bind=None):
+    """Delete events acknowledged by every consumer; returns the number deleted."""
+    bind = bind if bind is not None else engine
+    with bind.begin() as conn:
+        upto = conn.execute(select(func.min(offsets.c.acked))).scalar()
+        if not upto:
+            return 0
+        return conn.execute(delete(outbox).where(outbox.c.id <= upto)).rowcount
+
+
+def status(bind=None):
+    bind = bind if bind is not None else engine
+    with bind.connect() as conn:
+        end = head(conn)
+        return end, [(name, acked, end - acked, ts) for name, acked, ts in
+                     conn.execute(select(offsets.c.name, offsets.c.acked, offsets.c.updated_at).order_by(offsets.c.name))]
+
+
+def tail_shards(name, router, idle=1.0):
+    """Consumer.tail() over every shard in the map, as (shard index, event).
+
+    Offsets are per shard, so each shard has its own consumer `name`; shards
+    added by a split are picked up as the map changes.
+    """
+    consumers = {}
+    while True:
+        got = False
+        for i, eng in enumerate(router.all_engines()):
+            c = consumers.get(eng.url)
+            if c is None:
+                c = consumers[eng.url] = Consumer(name, bind=eng)
+            before = c.offset
+            for event in c.poll():
+                yield i, event
+            if c.offset != before:
+                c.ack()
+                got = True
+        if not got:
+            time.sleep(idle)
+
+
+if __name__ == "__main__":
+    from shards import ShardRouter
+
+    args = sys.argv[1:]
+    router = ShardRouter.load()
+    if args[:1] == ["tail"] and len(args) == 2:
+        try:
+            for shard, (i, topic, cid, ts, payload) in tail_shards(args[1], router):
+                print(json.dumps({"shard": shard, "offset": i, "topic": topic, "customer_id": cid,
+                                  "created_at": ts.isoformat(), **payload}), flush=True)
+        except KeyboardInterrupt:
+            pass
+    elif args[:1] == ["status"]:
+        for shard, eng in enumerate(router.all_engines()):
+            end, rows = status(eng)
+            print(f"shard {shard} head: {end}")
+            for name, acked, lag, ts in rows:
+                print(f"{name:<20} acked {acked:>10}  lag {lag:>8}  last ack {ts:%Y-%m-%d %H:%M:%S}")
+    elif args[:1] == ["prune"]:
+        print(f"pruned {sum(prune(eng) for eng in router.all_engines())} events")
+    else:
+        print("usage: python changefeed.py tail NAME | status | prune")
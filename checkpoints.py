@@ -0,0 +1,152 @@
+# checkpoints.py
+# Point-in-time balances from periodic balance checkpoints.
+# record_postings() writes a checkpoint every CHECKPOINT_EVERY postings of a customer;
+# close_day() adds an end-of-day checkpoint for every customer active that day.
+#   python checkpoints.py close-day [YYYY-MM-DD]         -> day-close checkpoints on every shard (default: yesterday)
+#   python checkpoints.py balance ACCOUNT_NO "YYYY-MM-DD HH:MM:SS"
+#   python checkpoints.py all "YYYY-MM-DD HH:MM:SS"      -> CSV of every balance at that time, all shards
+import os
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, delete, insert, func, case, and_, or_
+from bank_db import engine, Customer, Transaction, BalanceCheckpoint, CREDIT_TYPES, current_balance, utcnow
+from archive import CARRY, archive_dir_for, archived_until, history, load_partition
+
+customers = Customer.__table__
+transactions = Transaction.__table__
+checkpoints = BalanceCheckpoint.__table__
+TICK = timedelta(microseconds=1)
+
+_signed = case((transactions.c.type.in_(CREDIT_TYPES), transactions.c.amount), else_=-transactions.c.amount)
+
+
+def close_day(day=None, bind=None):
+    """Write an end-of-day checkpoint for every customer with postings on `day` (UTC date).
+
+    The balance is derived backwards from the current balance, so it can run
+    any time after the day has ended. Rerunning replaces that day's checkpoints.
+    """
+    bind = bind if bind is not None else engine
+    day = day or (utcnow() - timedelta(days=1)).date()
+    start = datetime(day.year, day.month, day.day)
+    end = start + timedelta(days=1)
+    as_of = end - TICK
+    with bind.begin() as conn:
+        active = select(transactions.c.customer_id).where(
+            transactions.c.timestamp >= start, transactions.c.timestamp < end, transactions.c.type != CARRY
+        ).distinct().subquery()
+        # take the write lock first so balances and later postings are read consistently
+        conn.execute(delete(checkpoints).where(checkpoints.c.as_of == as_of,
+                                               checkpoints.c.customer_id.in_(select(active.c.customer_id))))
+        later = dict(conn.execute(
+            select(transactions.c.customer_id, func.sum(_signed))
+            .where(transactions.c.timestamp >= end, transactions.c.customer_id.in_(select(active.c.customer_id)))
+            .group_by(transactions.c.customer_id)
+        ).all())
+        rows = [{"customer_id": cid, "as_of": as_of, "balance": (bal or 0.0) - later.get(cid, 0.0)}
+                for cid, bal in conn.execute(
+                    select(customers.c.id, current_balance).where(customers.c.id.in_(select(active.c.customer_id)))
+                )]
+        if rows:
+            conn.execute(insert(checkpoints), rows)
+    return len(rows)
+
+
+def balance_at(conn, customer_id, when, archive_dir=None):
+    """Balance of one customer including every transaction with timestamp <= `when`.
+
+    Seeks the nearest earlier checkpoint through the (customer_id, as_of) index
+    and replays only the transactions after it (see history() for `archive_dir`).
+    """
+    cp = conn.execute(
+        select(checkpoints.c.as_of, checkpoints.c.balance)
+        .where(checkpoints.c.customer_id == customer_id, checkpoints.c.as_of <= when)
+        .order_by(checkpoints.c.as_of.desc()).limit(1)
+    ).first()
+    bal = cp.balance if cp else 0.0
+    tail = history(conn, customer_id, start=cp.as_of + TICK if cp else None, end=when + TICK, archive_dir=archive_dir)
+    for _, kind, amount, _ in tail:
+        bal += amount if kind in CREDIT_TYPES else -amount
+    return bal
+
+
+def balances_at(conn, when, archive_dir=None):
+    """{customer_id: balance} as of `when` for every customer with history by then.
+
+    One query picks each customer's latest checkpoint and one grouped pass over
+    the transactions adds the tails; archived partitions are only read for tails
+    that start before the archive cutoff. `archive_dir` defaults to the archive
+    of the database `conn` is connected to.
+    """
+    archive_dir = archive_dir or archive_dir_for(conn)
+    latest = select(checkpoints.c.customer_id, func.max(checkpoints.c.as_of).label("as_of")) \
+        .where(checkpoints.c.as_of <= when).group_by(checkpoints.c.customer_id).subquery()
+    cps = conn.execute(
+        select(checkpoints.c.customer_id, checkpoints.c.as_of, checkpoints.c.balance)
+        .join(latest, and_(checkpoints.c.customer_id == latest.c.customer_id, checkpoints.c.as_of == latest.c.as_of))
+    ).all()
+    result = {cid: bal for cid, _, bal in cps}
+    floors = {cid: as_of for cid, as_of, _ in cps}
+
+    tail = select(transactions.c.customer_id, func.sum(_signed)) \
+        .select_from(transactions.outerjoin(latest, transactions.c.customer_id == latest.c.customer_id)) \
+        .where(transactions.c.timestamp <= when, transactions.c.type != CARRY,
+               or_(latest.c.as_of.is_(None), transactions.c.timestamp > latest.c.as_of)) \
+        .group_by(transactions.c.customer_id)
+    for cid, net in conn.execute(tail):
+        result[cid] = result.get(cid, 0.0) + net
+
+    until = archived_until(archive_dir)
+    if until is None:
+        return result
+    # the hot tails above skipped carry_forward rows, so add the archived detail they stand for
+    ids = np.array(sorted(floors), dtype=np.int64)
+    # customers without a checkpoint get a floor before any timestamp
+    ids_floor = np.array([floors[c] for c in ids.tolist()] + [datetime.min], dtype="datetime64[us]")
+    hi = np.datetime64(min(when, until), "us")
+    names = sorted(f[13:20] for f in os.listdir(archive_dir) if f.startswith("transactions_") and f.endswith(".npz"))
+    for month in names:
+        if np.datetime64(month, "us") > hi:
+            break
+        part = load_partition(month, archive_dir)
+        cids, ts = part["customer_id"], part["timestamp"]
+        idx = np.searchsorted(ids, cids)
+        found = idx < len(ids)
+        found[found] = ids[idx[found]] == cids[found]
+        floor = ids_floor[np.where(found, idx, len(ids))]
+        mask = (ts > floor) & (ts <= hi) & (part["type"] != CARRY)
+        if not mask.any():
+            continue
+        amount = part["amount"][mask]
+        signed = np.where(np.isin(part["type"][mask], CREDIT_TYPES), amount, -amount)
+        uniq, inv = np.unique(cids[mask], return_inverse=True)
+        for cid, net in zip(uniq.tolist(), np.bincount(inv, weights=signed).tolist()):
+            result[cid] = result.get(cid, 0.0) + net
+    return result
+
+
+if __name__ == "__main__":
+    from shards import ShardRouter
+
+    args = sys.argv[1:]
+    router = ShardRouter.load()
+    if args[:1] == ["close-day"]:
+        day = datetime.strptime(args[1], "%Y-%m-%d").date() if len(args) > 1 else None
+        print(f"wrote {sum(close_day(day, bind=eng) for eng in router.all_engines())} checkpoints")
+    elif args[:1] == ["balance"] and len(args) == 3:
+        with router.engine_for(args[1]).connect() as conn:
+            cid = conn.execute(select(customers.c.id).where(customers.c.account_no == args[1])).scalar()
+            if cid is None:
+                print("account not found")
+            else:
+                print(f"{balance_at(conn, cid, datetime.fromisoformat(args[2])):,.2f}")
+    elif args[:1] == ["all"] and len(args) == 2:
+        print("account_no,balance")
+        for eng in router.all_engines():
+            with eng.connect() as conn:
+                accs = dict(conn.execute(select(customers.c.id, customers.c.account_no)).all())
+                for cid, bal in sorted(balances_at(conn, datetime.fromisoformat(args[1])).items()):
+                    print(f"{accs.get(cid, cid)},{bal:.2f}")
+    else:
+        print('usage: python checkpoints.py close-day [YYYY-MM-DD] | balance ACCOUNT_NO "YYYY-MM-DD HH:MM:SS" | all "YYYY-MM-DD HH:MM:SS"')
@@ -0,0 +1,192 @@
+# fraud.py
+# In-process velocity screening of postings (the "defender service" from the About page).
+# Keeps per-account sliding-window count/amount aggregates in memory, so a posting is
+# screened without touching the database.
+#   python fraud.py --bench [N]   -> added latency per posting
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta, timezone
+from sqlalchemy import select
+from bank_db import Transaction, utcnow
+from archive import CARRY
+
+transactions = Transaction.__table__
+
+# window name -> (span seconds, buckets)
+WINDOWS = {"1m": (60, 12), "1h": (3600, 12), "1d": (86400, 24)}
+# window name -> (max postings, max amount) before a posting is flagged; twice that is held
+LIMITS = {"1m": (5, 20000.0), "1h": (30, 100000.0), "1d": (100, 500000.0)}
+MAX_ACCOUNTS = 50000
+
+OK, FLAG, HOLD = "ok", "flag", "hold"
+
+
+class _Window:
+    # Ring of fixed-width buckets with running totals: add and read are O(1)
+    # amortised, expiring at most one lap of buckets per call.
+    __slots__ = ("width", "n", "counts", "amounts", "head", "count", "amount")
+
+    def __init__(self, span, buckets):
+        self.width = span / buckets
+        self.n = buckets
+        self.counts = [0] * buckets
+        self.amounts = [0.0] * buckets
+        self.head = None  # absolute number of the newest bucket
+        self.count = 0
+        self.amount = 0.0
+
+    def _advance(self, b):
+        if self.head is None or b - self.head >= self.n:
+            self.counts = [0] * self.n
+            self.amounts = [0.0] * self.n
+            self.count, self.amount = 0, 0.0
+        else:
+            for k in range(self.head + 1, b + 1):
+                i = k % self.n
+                self.count -= self.counts[i]
+                self.amount -= self.amounts[i]
+                self.counts[i], self.amounts[i] = 0, 0.0
+            if self.count == 0:
+                self.amount = 0.0
+        self.head = b
+
+    def totals(self, t):
+        b = int(t // self.width)
+        if self.head is None or b > self.head:
+            self._advance(b)
+        return self.count, self.amount
+
+    def add(self, t, amount):
+        b = int(t // self.width)
+        if self.head is None or b > self.head:
+            self._advance(b)
+        elif b <= self.head - self.n:
+            return  # older than the window
+        i = b % self.n
+        self.counts[i] += 1
+        self.amounts[i] += amount
+        self.count += 1
+        self.amount += amount
+
+
+class VelocityScreen:
+    """Sliding-window posting velocity per account, bounded to `max_accounts` (LRU).
+
+    assess() is called before a posting is applied and observe() after it
+    commits. Evicting the least recently active account only loses data once
+    more than `max_accounts` accounts have been active within a day.
+    """
+
+    def __init__(self, limits=LIMITS, max_accounts=MAX_ACCOUNTS):
+        self.limits = limits
+        self.max_accounts = max_accounts
+        self.accounts = OrderedDict()
+        self.alerts = deque(maxlen=500)  # (time, customer_id, amount, verdict, reasons)
+        self.lock = threading.Lock()
+
+    def _state(self, cid):
+        st = self.accounts.get(cid)
+        if st is None:
+            st = self.accounts[cid] = {w: _Window(*WINDOWS[w]) for w in WINDOWS}
+            if len(self.accounts) > self.max_accounts:
+                self.accounts.popitem(last=False)
+        else:
+            self.accounts.move_to_end(cid)
+        return st
+
+    def assess(self, cid, amount, t=None):
+        """Return (verdict, reasons) for a new posting of `amount`, counting it in."""
+        t = time.time() if t is None else t
+        verdict, reasons = OK, []
+        with self.lock:
+            st = self.accounts.get(cid)
+            for w, (max_n, max_amt) in self.limits.items():
+                n, amt = st[w].totals(t) if st is not None else (0, 0.0)
+                n, amt = n + 1, amt + amount
+                if n > max_n or amt > max_amt:
+                    reasons.append(f"{n} postings / {amt:,.2f} in {w}")
+                    hard = n > 2 * max_n or amt > 2 * max_amt
+                    verdict = HOLD if hard or verdict == HOLD else FLAG
+        if verdict != OK:
+            self.alerts.append((t, cid, amount, verdict, reasons))
+        return verdict, reasons
+
+    def observe(self, cid, amount, t=None):
+        t = time.time() if t is None else t
+        with self.lock:
+            for win in self._state(cid).values():
+                win.add(t, amount)
+
+    def warm(self, conn, now=None, key=None):
+        """Rebuild the windows from the last day of transactions (run once at startup).
+
+        `key` maps a customer id to the key assess()/observe() are called with,
+        when that is not the id itself (e.g. the account number across shards).
+        """
+        now = now or utcnow()
+        q = select(transactions.c.customer_id, transactions.c.timestamp, transactions.c.amount) \
+            .where(transactions.c.timestamp >= now - timedelta(seconds=WINDOWS["1d"][0]),
+                   transactions.c.type != CARRY) \
+            .order_by(transactions.c.timestamp)
+        n = 0
+        for cid, ts, amount in conn.execution_options(stream_results=True).execute(q):
+            self.observe(key(cid) if key else cid, amount, ts.replace(tzinfo=timezone.utc).timestamp())
+            n += 1
+        return n
+
+
+def _bench(n=1000000, n_accounts=100000):
+    import random, os, tempfile
+    from sqlalchemy import insert, func
+    from bank_db import init_db, make_engine, Customer
+
+    rnd = random.Random(7)
+    screen = VelocityScreen()
+    t = time.time()
+    posts = [(rnd.randrange(n_accounts), rnd.uniform(1, 5000)) for _ in range(n)]
+    t0 = time.perf_counter()
+    held = 0
+    for i, (cid, amt) in enumerate(posts):
+        now = t + i * 0.001
+        verdict, _ = screen.assess(cid, amt, now)
+        if verdict != HOLD:
+            screen.observe(cid, amt, now)
+        else:
+            held += 1
+    dt = time.perf_counter() - t0
+    print(f"in-memory screen: {dt / n * 1e6:.2f} us per posting ({n} postings, "
+          f"{len(screen.accounts)} accounts tracked, {held} held)")
+
+    # for comparison: the naive per-posting query over the last day of transactions
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    eng = make_engine(f"sqlite:///{path}")
+    init_db(eng)
+    now = utcnow()
+    with eng.begin() as conn:
+        conn.execute(insert(Customer.__table__), [
+            {"id": i + 1, "name": "b", "age": 30, "email": f"{i}@b", "account_no": f"B{i}", "pin_hash": "x"}
+            for i in range(2000)
+        ])
+        conn.execute(insert(transactions), [
+            {"customer_id": rnd.randrange(1, 2001), "amount": 10.0, "type": "deposit",
+             "timestamp": now - timedelta(seconds=rnd.randrange(86400 * 30))}
+            for _ in range(200000)
+        ])
+    q = select(func.count(), func.sum(transactions.c.amount)).where(
+        transactions.c.timestamp >= now - timedelta(days=1))
+    k = 2000
+    with eng.connect() as conn:
+        t0 = time.perf_counter()
+        for i in range(k):
+            conn.execute(q.where(transactions.c.customer_id == rnd.randrange(1, 2001))).first()
+        dt = time.perf_counter() - t0
+    print(f"naive DB query:   {dt / k * 1e6:.2f} us per posting (1-day window over 200k rows)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        _bench(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    else:
+        print("usage: python fraud.py --bench [N]")
@@ -0,0 +1,217 @@
+# hot.py
+# Hot accounts (merchants, payroll sources): credits go to one of N balance slots picked at
+# random instead of the customers row, so concurrent postings don't all queue on one row.
+# The balance is customers.balance plus the slots (bank_db.current_balance); debits check that
+# sum under the customers row lock. fold() adds the slots to customers.balance and records
+# the monthly summaries, checkpoints and deposit totals the postings left out.
+#   python hot.py enable ACCOUNT_NO [SLOTS]   -> switch an account to slotted balances
+#   python hot.py disable ACCOUNT_NO          -> fold and switch back
+#   python hot.py fold [SECONDS]              -> fold once, or every SECONDS, on every shard
+#   python hot.py status                      -> hot accounts and what is waiting to be folded, all shards
+#   python hot.py --bench [SECONDS] [WORKERS] -> postings/sec to one account, single row vs slots
+import sys
+import time
+from sqlalchemy import select, update, insert, delete, func, bindparam
+from bank_db import (
+    engine, Customer, Transaction, BalanceSlot, current_balance, executemany, record_folded,
+)
+
+SLOTS = 16
+FOLD_EVERY = 1.0
+
+customers = Customer.__table__
+transactions = Transaction.__table__
+slots = BalanceSlot.__table__
+
+_drain_slot = (
+    update(slots)
+    .where(slots.c.customer_id == bindparam("p_cid"), slots.c.slot == bindparam("p_slot"))
+    .values(amount=slots.c.amount - bindparam("p_amount"))
+)
+
+
+def _lock(conn, customer_id):
+    # a no-op write: the row lock elsewhere, the database write lock on SQLite
+    conn.execute(update(customers).where(customers.c.id == customer_id).values(id=customers.c.id))
+
+
+def _find(conn, account_no):
+    row = conn.execute(select(customers.c.id, customers.c.hot_slots)
+                       .where(customers.c.account_no == account_no)).first()
+    if row is None:
+        raise ValueError(f"no account {account_no}")
+    return row
+
+
+def fold_account(conn, customer_id):
+    """Fold one hot account's slots and record its postings since the last fold.
+
+    Takes the customers row lock, then every slot row, so in-flight postings
+    to the account finish first and new ones wait; keep the transaction short.
+    Returns the number of postings recorded.
+    """
+    _lock(conn, customer_id)
+    folded = conn.execute(select(customers.c.hot_slots, customers.c.hot_folded_tx)
+                          .where(customers.c.id == customer_id)).first()
+    if folded is None or not folded.hot_slots:
+        return 0
+    held = conn.execute(select(slots.c.slot, slots.c.amount).where(slots.c.customer_id == customer_id)
+                        .with_for_update()).all()
+    held = [(s, a) for s, a in held if a]
+    if held:
+        executemany(conn, _drain_slot, [{"p_cid": customer_id, "p_slot": s, "p_amount": a} for s, a in held])
+        conn.execute(update(customers).where(customers.c.id == customer_id)
+                     .values(balance=customers.c.balance + sum(a for _, a in held)))
+    txs = [dict(r._mapping) for r in conn.execute(
+        select(transactions.c.id, transactions.c.customer_id, transactions.c.amount, transactions.c.type,
+               transactions.c.timestamp)
+        .where(transactions.c.customer_id == customer_id, transactions.c.id > (folded.hot_folded_tx or 0))
+        .order_by(transactions.c.id)
+    )]
+    if txs:
+        record_folded(conn, txs)
+        conn.execute(update(customers).where(customers.c.id == customer_id).values(hot_folded_tx=txs[-1]["id"]))
+    return len(txs)
+
+
+def fold(bind=None):
+    """Fold every hot account, each in its own transaction; returns (accounts, postings)."""
+    bind = bind if bind is not None else engine
+    with bind.connect() as conn:
+        ids = conn.execute(select(customers.c.id).where(customers.c.hot_slots > 0)).scalars().all()
+    n = 0
+    for cid in ids:
+        with bind.begin() as conn:
+            n += fold_account(conn, cid)
+    return len(ids), n
+
+
+def enable(account_no, n_slots=SLOTS, bind=None):
+    """Switch an account to `n_slots` balance slots (or change the number of slots)."""
+    if n_slots < 1:
+        raise ValueError("a hot account needs at least one slot")
+    bind = bind if bind is not None else engine
+    with bind.begin() as conn:
+        cid, was = _find(conn, account_no)
+        _lock(conn, cid)
+        if was:
+            fold_account(conn, cid)
+            conn.execute(delete(slots).where(slots.c.customer_id == cid, slots.c.slot >= n_slots))
+        else:
+            # postings so far were recorded as they happened
+            last = conn.execute(select(func.max(transactions.c.id)).where(transactions.c.customer_id == cid)).scalar()
+            conn.execute(update(customers).where(customers.c.id == cid).values(hot_folded_tx=last or 0))
+        have = set(conn.execute(select(slots.c.slot).where(slots.c.customer_id == cid)).scalars())
+        missing = [{"customer_id": cid, "slot": s, "amount": 0.0} for s in range(n_slots) if s not in have]
+        if missing:
+            conn.execute(insert(slots), missing)
+        conn.execute(update(customers).where(customers.c.id == cid).values(hot_slots=n_slots))
+    return cid
+
+
+def disable(account_no, bind=None):
+    """Fold the account's slots for the last time and go back to the single balance row."""
+    bind = bind if bind is not None else engine
+    with bind.begin() as conn:
+        cid, was = _find(conn, account_no)
+        if was:
+            fold_account(conn, cid)
+            conn.execute(delete(slots).where(slots.c.customer_id == cid))
+            conn.execute(update(customers).where(customers.c.id == cid).values(hot_slots=None, hot_folded_tx=None))
+    return cid
+
+
+def status(bind=None):
+    """(account_no, slots, balance, unfolded amount, postings waiting) for every hot account."""
+    bind = bind if bind is not None else engine
+    unfolded = select(func.sum(slots.c.amount)).where(slots.c.customer_id == customers.c.id).scalar_subquery()
+    waiting = select(func.count()).where(transactions.c.customer_id == customers.c.id,
+                                         transactions.c.id > customers.c.hot_folded_tx).scalar_subquery()
+    with bind.connect() as conn:
+        return conn.execute(
+            select(customers.c.account_no, customers.c.hot_slots, current_balance, unfolded, waiting)
+            .where(customers.c.hot_slots > 0).order_by(customers.c.account_no)
+        ).all()
+
+
+# ---------- BENCHMARK ----------
+def _bench_worker(url, seconds, seed):
+    import random
+    from sqlalchemy.orm import sessionmaker
+    from bank_db import make_engine, post_transaction
+
+    random.seed(seed)
+    db = sessionmaker(bind=make_engine(url))()
+    user = db.query(Customer).filter(Customer.account_no == "HOT").one()
+    done, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        post_transaction(db, user, 1.0, "deposit", "bench")
+        done += 1
+    db.close()
+    return done
+
+
+def _bench(seconds=5.0, workers=8, n_slots=SLOTS):
+    import os, tempfile, threading
+    from concurrent.futures import ProcessPoolExecutor
+    from bank_db import init_db, make_engine, MonthlySummary
+
+    for label, hot in (("single row", False), (f"{n_slots} slots", True)):
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+        eng = make_engine(url)
+        init_db(eng)
+        with eng.begin() as conn:
+            conn.execute(insert(customers), {"name": "m", "age": 30, "email": "hot@bench", "account_no": "HOT",
+                                             "pin_hash": "x", "balance": 0.0, "account_type": "merchant"})
+        if hot:
+            enable("HOT", n_slots, bind=eng)
+        stop = threading.Event()
+
+        def folder():
+            while not stop.wait(FOLD_EVERY):
+                fold(eng)
+        th = threading.Thread(target=folder)
+        if hot:
+            th.start()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            total = sum(pool.map(_bench_worker, [url] * workers, [seconds] * workers, range(workers)))
+        stop.set()
+        if hot:
+            th.join()
+            fold(eng)
+        with eng.connect() as conn:
+            bal = conn.execute(select(current_balance).where(customers.c.account_no == "HOT")).scalar()
+            closing = conn.execute(select(func.sum(MonthlySummary.__table__.c.closing))).scalar()
+        print(f"{label:<12} {workers} writer processes: {total / seconds:8,.0f} postings/sec "
+              f"(balance {bal:,.0f}, monthly closing {closing:,.0f}, posted {total:,})")
+
+
+if __name__ == "__main__":
+    from shards import ShardRouter
+
+    args = sys.argv[1:]
+    router = ShardRouter.load()
+    if args[:1] == ["enable"] and len(args) in (2, 3):
+        enable(args[1], int(args[2]) if len(args) == 3 else SLOTS, bind=router.engine_for(args[1]))
+        print(f"{args[1]} is a hot account")
+    elif args[:1] == ["disable"] and len(args) == 2:
+        disable(args[1], bind=router.engine_for(args[1]))
+        print(f"{args[1]} is back to a single balance row")
+    elif args[:1] == ["fold"] and len(args) <= 2:
+        while True:
+            for i, eng in enumerate(router.all_engines()):
+                accounts, n = fold(eng)
+                if n:
+                    print(f"shard {i}: folded {n} postings on {accounts} hot accounts", flush=True)
+            if len(args) == 1:
+                break
+            time.sleep(float(args[1]))
+    elif args[:1] == ["status"]:
+        for acc, n, bal, unfolded, waiting in (r for eng in router.all_engines() for r in status(eng)):
+            print(f"{acc:<12} {n:>3} slots  balance {bal:>14,.2f}  unfolded {unfolded or 0:>12,.2f}  "
+                  f"{waiting} postings to fold")
+    elif args[:1] == ["--bench"]:
+        _bench(float(args[1]) if len(args) > 1 else 5.0, int(args[2]) if len(args) > 2 else 8)
+    else:
+        print("usage: python hot.py enable ACCOUNT_NO [SLOTS] | disable ACCOUNT_NO | fold [SECONDS] | status | "
+              "--bench [SECONDS] [WORKERS]")
@@ -0,0 +1,181 @@
+# idempotency.py
+# Idempotency keys for deposit/withdraw submissions. A resubmitted form (Streamlit rerun,
+# double click, client retry) gets the original result back instead of posting again.
+# Keys are stored with a unique constraint (idempotency_keys) in the posting's own
+# transaction, and checked through an in-process LRU first.
+#   python idempotency.py purge     -> delete keys older than IDEMPOTENCY_TTL seconds, on every shard
+#   python idempotency.py --bench   -> cost of a duplicate check, cache vs database
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+from bank_db import engine, IdempotencyKey, InsufficientFunds, stage_transaction, balance_of, utcnow
+from limits import DailyLimitExceeded, enforce_daily_limit
+
+TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds a key is remembered
+CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "100000"))
+
+keys = IdempotencyKey.__table__
+
+
+class IdempotencyConflict(ValueError):
+    pass
+
+
+class KeyCache:
+    """Bounded LRU of key -> (created_at, result) for recently seen keys."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, cutoff):
+        with self.lock:
+            hit = self.items.get(key)
+            if hit is None:
+                return None
+            if hit[0] < cutoff:
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return hit[1]
+
+    def put(self, key, created_at, result):
+        with self.lock:
+            self.items[key] = (created_at, result)
+            self.items.move_to_end(key)
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+_cache = KeyCache()
+
+
+def _cutoff(ttl=None):
+    return utcnow() - timedelta(seconds=TTL if ttl is None else ttl)
+
+
+def _same_request(result, customer_id, amount, kind):
+    if (result["customer_id"], result["type"], result["amount"]) != (customer_id, kind, float(amount)):
+        raise IdempotencyConflict("This request key was already used for a different posting.")
+    return result
+
+
+def lookup(db, key, cache=_cache, ttl=None):
+    """The original result for `key`, or None if the key is new or has expired."""
+    cutoff = _cutoff(ttl)
+    hit = cache.get(key, cutoff)
+    if hit is not None:
+        return hit
+    row = db.execute(select(keys.c.created_at, keys.c.result).where(keys.c.key == key)).first()
+    if row is None or row.created_at < cutoff or row.result is None:
+        return None
+    result = json.loads(row.result)
+    cache.put(key, row.created_at, result)
+    return result
+
+
+def post_once(db, user, amount, kind, key, note=None, cache=_cache, ttl=None):
+    """post_transaction() at most once per `key`; returns (result, duplicate).
+
+    A key seen before returns its original result (transaction id, amount,
+    balance after it, time) with duplicate=True and leaves the balance alone;
+    a cache hit answers that without touching the database. Otherwise the key
+    row is inserted before the balance changes, so of two racing submissions
+    the second fails on the unique key and reads the first one's result.
+    The daily limit is checked after the key insert, in the posting's
+    transaction. Raises IdempotencyConflict if the key was used for a different
+    posting, DailyLimitExceeded if the posting would pass today's limit, and
+    InsufficientFunds if a debit is not covered.
+    """
+    hit = cache.get(key, _cutoff(ttl))
+    if hit is not None:
+        return _same_request(hit, user.id, amount, kind), True
+
+    for _ in range(2):
+        now = utcnow()
+        row = IdempotencyKey(key=key, customer_id=user.id, created_at=now)
+        db.add(row)
+        try:
+            db.flush()
+            break
+        except IntegrityError:
+            db.rollback()
+            db.refresh(user)
+            result = lookup(db, key, cache, ttl)
+            if result is not None:
+                return _same_request(result, user.id, amount, kind), True
+            # the stored key has expired: forget it and claim it again
+            db.execute(delete(keys).where(keys.c.key == key, keys.c.created_at < _cutoff(ttl)))
+    else:
+        raise IdempotencyConflict("This request key is in use.")
+
+    try:
+        enforce_daily_limit(db.connection(), user.id, user.account_type, kind, amount, hot=bool(user.hot_slots))
+        tx = stage_transaction(db, user, amount, kind, note)
+    except (DailyLimitExceeded, InsufficientFunds):
+        db.rollback()  # releases the key too, so the form can be resubmitted
+        raise
+    balance = balance_of(db.connection(), user.id) if user.hot_slots else user.balance
+    result = {"transaction_id": tx.id, "customer_id": user.id, "type": kind, "amount": tx.amount,
+              "balance": balance, "timestamp": tx.timestamp.isoformat()}
+    row.result = json.dumps(result)
+    db.commit(); db.refresh(user)
+    cache.put(key, now, result)
+    return result, False
+
+
+def purge_expired(bind=None, ttl=None):
+    """Delete keys older than the TTL; returns the number deleted."""
+    bind = bind if bind is not None else engine
+    with bind.begin() as conn:
+        return conn.execute(delete(keys).where(keys.c.created_at < _cutoff(ttl))).rowcount
+
+
+def _bench(n=20000):
+    import tempfile, time, uuid
+    from sqlalchemy.orm import sessionmaker
+    from bank_db import init_db, make_engine, Customer
+
+    eng = make_engine(f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    init_db(eng)
+    db = sessionmaker(bind=eng)()
+    user = Customer(name="b", age=30, email="b@bench", account_no="B1", pin_hash="x", balance=0.0)
+    db.add(user); db.commit()
+    ids = [uuid.uuid4().hex for _ in range(2000)]
+    t0 = time.perf_counter()
+    for k in ids:
+        post_once(db, user, 1.0, "deposit", k)
+    first = (time.perf_counter() - t0) / len(ids)
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        post_once(db, user, 1.0, "deposit", ids[i % len(ids)])
+    cached = (time.perf_counter() - t0) / n
+
+    cold = KeyCache(0)  # every check misses the cache and hits the unique key
+    t0 = time.perf_counter()
+    for k in ids:
+        post_once(db, user, 1.0, "deposit", k, cache=cold)
+    uncached = (time.perf_counter() - t0) / len(ids)
+    print(f"first submission:             {first * 1e6:9.1f} us (posting + key)")
+    print(f"duplicate, cache hit:         {cached * 1e6:9.1f} us")
+    print(f"duplicate, not in cache:      {uncached * 1e6:9.1f} us (unique-key conflict + read)")
+    print(f"balance after {len(ids)} distinct keys and {n + len(ids)} duplicates: {user.balance:,.2f}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["purge"]:
+        from shards import ShardRouter
+
+        print(f"deleted {sum(purge_expired(eng) for eng in ShardRouter.load().all_engines())} expired keys")
+    elif args[:1] == ["--bench"]:
+        _bench()
+    else:
+        print("usage: python idempotency.py purge | --bench")
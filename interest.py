@@ -0,0 +1,172 @@
+# interest.py
+# Nightly interest accrual and fees over all accounts, computed in NumPy chunks.
+#   python interest.py [YYYY-MM-DD]   -> accrue for that day (default: yesterday, UTC), on every shard
+#   python interest.py --bench [N]    -> accounts/sec on a scratch DB
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, update, insert, bindparam
+from bank_db import engine, Customer, Transaction, AccrualRun, current_balance, executemany, record_postings, utcnow
+from limits import DEFAULT_ACCOUNT_TYPE
+
+# account type -> [(balance from, annual rate)]; each band of the balance earns its own rate
+INTEREST_TIERS = {
+    "savings": [(0.0, 0.025), (10000.0, 0.03), (100000.0, 0.035)],
+    "current": [(0.0, 0.0)],
+    "merchant": [(0.0, 0.0), (50000.0, 0.01)],
+}
+# account type -> (minimum balance, fee per day while below it)
+DAILY_FEES = {"savings": (0.0, 0.0), "current": (1000.0, 0.5), "merchant": (5000.0, 2.0)}
+DAYS_PER_YEAR = 365
+CHUNK_SIZE = 50000
+
+customers = Customer.__table__
+transactions = Transaction.__table__
+runs = AccrualRun.__table__
+
+_apply_delta = (
+    update(customers)
+    .where(customers.c.id == bindparam("p_cid"))
+    .values(balance=customers.c.balance + bindparam("p_delta"))
+)
+_insert_tx = insert(transactions).values(
+    customer_id=bindparam("p_cid"), amount=bindparam("p_amount"), type=bindparam("p_type"),
+    note=bindparam("p_note"), timestamp=bindparam("p_ts"), ref=bindparam("p_ref"),
+)
+
+
+def daily_interest(balances, kinds):
+    """Interest for one day, rounded to cents, per account (arrays of balance and account type)."""
+    out = np.zeros(len(balances))
+    pos = np.maximum(balances, 0.0)
+    for kind, tiers in INTEREST_TIERS.items():
+        m = kinds == kind
+        if not m.any():
+            continue
+        b, acc = pos[m], np.zeros(int(m.sum()))
+        for i, (lo, rate) in enumerate(tiers):
+            hi = tiers[i + 1][0] if i + 1 < len(tiers) else np.inf
+            acc += np.clip(b - lo, 0.0, hi - lo) * rate
+        out[m] = acc / DAYS_PER_YEAR
+    return np.round(out, 2)
+
+
+def daily_fees(balances, kinds):
+    """Fee for one day per account; never more than the account holds, so a fee alone cannot overdraw it."""
+    out = np.zeros(len(balances))
+    for kind, (minimum, fee) in DAILY_FEES.items():
+        if fee:
+            out[(kinds == kind) & (balances < minimum)] = fee
+    return np.round(np.minimum(out, np.maximum(balances, 0.0)), 2)
+
+
+def accrue(day=None, chunk_size=CHUNK_SIZE, bind=None):
+    """Post one day of interest and fees to every account.
+
+    Accounts are taken in id order, `chunk_size` at a time. Each chunk is
+    posted in one transaction together with the run's progress row, so the
+    date is never posted twice: a rerun resumes after the last committed
+    chunk, and a finished date is skipped. Returns a dict of totals.
+    """
+    bind = bind if bind is not None else engine
+    day = day or (utcnow() - timedelta(days=1)).date()
+    key = day.isoformat()
+    note_i, note_f, ref = f"interest for {key}", f"fees for {key}", f"accrual-{key}"
+    totals = {"day": key, "accounts": 0, "interest": 0.0, "fees": 0.0, "seconds": 0.0}
+
+    with bind.begin() as conn:
+        run = conn.execute(select(runs).where(runs.c.day == key)).first()
+        if run is None:
+            conn.execute(insert(runs).values(day=key, last_customer_id=0, accounts=0))
+        elif run.finished_at is not None:
+            return totals
+    after = run.last_customer_id if run is not None else 0
+
+    t0 = time.perf_counter()
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select(customers.c.id, current_balance, customers.c.account_type)
+                .where(customers.c.id > after).order_by(customers.c.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                conn.execute(update(runs).where(runs.c.day == key).values(finished_at=utcnow()))
+                break
+            ids = np.array([r[0] for r in rows], dtype=np.int64)
+            # claim the chunk; a concurrent run of the same date makes this match nothing
+            claimed = conn.execute(
+                update(runs).where(runs.c.day == key, runs.c.last_customer_id == after)
+                .values(last_customer_id=int(ids[-1]), accounts=runs.c.accounts + len(rows))
+            ).rowcount
+            if claimed != 1:
+                raise RuntimeError(f"accrual for {key} is running elsewhere")
+
+            balances = np.array([r[1] or 0.0 for r in rows], dtype=np.float64)
+            kinds = np.array([r[2] or DEFAULT_ACCOUNT_TYPE for r in rows], dtype=str)
+            kinds[~np.isin(kinds, list(INTEREST_TIERS))] = DEFAULT_ACCOUNT_TYPE
+            interest = daily_interest(balances, kinds)
+            fees = daily_fees(balances, kinds)
+            delta = np.round(interest - fees, 2)
+
+            now = utcnow()
+            txs = []
+            for (sel, amounts, kind, note) in ((interest > 0, interest, "interest", note_i),
+                                               (fees > 0, fees, "fee", note_f)):
+                for cid, amount in zip(ids[sel].tolist(), amounts[sel].tolist()):
+                    txs.append({"p_cid": cid, "p_amount": amount, "p_type": kind, "p_note": note,
+                                "p_ts": now, "p_ref": ref})
+            changed = delta != 0
+            if changed.any():
+                executemany(conn, _apply_delta, [
+                    {"p_cid": cid, "p_delta": d} for cid, d in zip(ids[changed].tolist(), delta[changed].tolist())
+                ])
+            if txs:
+                executemany(conn, _insert_tx, txs)
+                record_postings(conn, [{"customer_id": t["p_cid"], "amount": t["p_amount"], "type": t["p_type"],
+                                        "timestamp": now, "note": t["p_note"], "ref": ref} for t in txs])
+        after = int(ids[-1])
+        totals["accounts"] += len(rows)
+        totals["interest"] += float(interest.sum())
+        totals["fees"] += float(fees.sum())
+    totals["seconds"] = time.perf_counter() - t0
+    return totals
+
+
+def _bench(n_accounts=200000):
+    import os, random, tempfile
+    from bank_db import init_db, make_engine
+
+    rnd = random.Random(11)
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    eng = make_engine(f"sqlite:///{path}")
+    init_db(eng)
+    with eng.begin() as conn:
+        conn.execute(insert(customers), [
+            {"name": "b", "age": 30, "email": f"{i}@bench", "account_no": f"B{i:08d}", "pin_hash": "x",
+             "balance": round(rnd.lognormvariate(8, 1.5), 2), "account_type": rnd.choice(list(INTEREST_TIERS))}
+            for i in range(n_accounts)
+        ])
+    res = accrue(bind=eng)
+    print(f"accrued {res['accounts']} accounts in {res['seconds']:.2f}s "
+          f"-> {res['accounts'] / res['seconds']:,.0f} accounts/sec "
+          f"(interest {res['interest']:,.2f}, fees {res['fees']:,.2f})")
+    again = accrue(bind=eng)
+    print(f"rerun for {again['day']}: {again['accounts']} accounts posted")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--bench"]:
+        _bench(int(args[1]) if len(args) > 1 else 200000)
+    elif len(args) <= 1:
+        from shards import ShardRouter
+
+        day = datetime.strptime(args[0], "%Y-%m-%d").date() if args else None
+        for i, eng in enumerate(ShardRouter.load().all_engines()):
+            res = accrue(day, bind=eng)
+            rate = res["accounts"] / res["seconds"] if res["seconds"] else 0
+            print(f"shard {i} {res['day']}: {res['accounts']} accounts, interest {res['interest']:,.2f}, "
+                  f"fees {res['fees']:,.2f} ({rate:,.0f} accounts/sec)")
+    else:
+        print("usage: python interest.py [YYYY-MM-DD] | --bench [N]")
@@ -0,0 +1,53 @@
+# limits.py
+# Daily deposit/withdrawal limits per account type (UTC days).
+# Today's totals come from the daily_totals counter table that record_postings() keeps,
+# so a check is a single-row read instead of a sum over today's transactions.
+from sqlalchemy import update
+from bank_db import daily_totals, Customer, DEBIT_TYPES
+
+ACCOUNT_TYPES = ("savings", "current", "merchant")
+DEFAULT_ACCOUNT_TYPE = "savings"
+# account type -> {"deposit": max per day, "withdraw": max per day (withdrawals + transfers out)}
+DAILY_LIMITS = {
+    "savings": {"deposit": 10000.0, "withdraw": 10000.0},
+    "current": {"deposit": 50000.0, "withdraw": 50000.0},
+    "merchant": {"deposit": 1000000.0, "withdraw": 200000.0},
+}
+
+customers = Customer.__table__
+
+
+class DailyLimitExceeded(ValueError):
+    pass
+
+
+def check_daily_limit(conn, customer_id, account_type, kind, amount):
+    """Return None if posting `amount` of `kind` keeps the account within today's limit,
+    otherwise the reason it does not."""
+    limits = DAILY_LIMITS.get(account_type or DEFAULT_ACCOUNT_TYPE, DAILY_LIMITS[DEFAULT_ACCOUNT_TYPE])
+    deposited, withdrawn = daily_totals(conn, customer_id)
+    if kind == "deposit":
+        used, cap, what = deposited, limits["deposit"], "deposit"
+    elif kind in DEBIT_TYPES:
+        used, cap, what = withdrawn, limits["withdraw"], "withdrawal"
+    else:
+        return None
+    if used + float(amount) > cap:
+        return f"Daily {what} limit of {cap:,.2f} reached ({max(cap - used, 0):,.2f} left today)."
+    return None
+
+
+def enforce_daily_limit(conn, customer_id, account_type, kind, amount, hot=False):
+    """check_daily_limit() inside the posting's own transaction; raises DailyLimitExceeded.
+
+    Takes the customer's row lock first (the database write lock on SQLite), so
+    two postings racing for the same allowance are checked one after the other
+    and the second sees the first one's totals. Deposits to a hot account are
+    only counted when the fold job records them, so for those the check stays
+    approximate and takes no lock, which would queue every deposit on the row.
+    """
+    if not (hot and kind == "deposit"):
+        conn.execute(update(customers).where(customers.c.id == customer_id).values(id=customers.c.id))
+    over = check_daily_limit(conn, customer_id, account_type, kind, amount)
+    if over:
+        raise DailyLimitExceeded(over)
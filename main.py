@@ -1,7 +1,15 @@
+import csv
 import json
+import os
 import random
 import string
-from pathlib import Path 
+import sys
+import time
+from pathlib import Path
+
+
+class BankError(Exception):
+    pass
 
 
 class Bank:
@@ -15,186 +23,287 @@ class Bank:
             print("No such File Exists.")
     except Exception as err:
         print(f"Exception occured as {err}")
+    # accountNo -> account; lookups are O(1) so long sessions and batch scripts stay fast
+    accounts = {str(i['accountNo']): i for i in data}
 
     @classmethod
     def __Update(cls):   #  moved outside except block
-        with open(cls.dataBase, 'w') as fs:
-            fs.write(json.dumps(Bank.data, indent=4))  # added indent for readability
+        # write a temp file and swap it in, so a crash mid-write never truncates data.json
+        tmp = cls.dataBase + '.tmp'
+        with open(tmp, 'w') as fs:
+            fs.write(json.dumps(list(cls.accounts.values()), indent=4))  # added indent for readability
+        os.replace(tmp, cls.dataBase)
 
     @classmethod
-    def __accountgerate(cls):   
-        alpha = random.choices(string.ascii_letters, k=4)
-        nums = random.choices(string.digits, k=4)
-        spchar = random.choices("!@#$&%^*", k=1)  
-        id = alpha + nums + spchar
-        random.shuffle(id)
-        return "".join(id)
+    def save(cls):
+        cls.__Update()
 
+    @classmethod
+    def __accountgerate(cls):
+        while True:
+            alpha = random.choices(string.ascii_letters, k=4)
+            nums = random.choices(string.digits, k=4)
+            spchar = random.choices("!@#$&%^*", k=1)
+            id = alpha + nums + spchar
+            random.shuffle(id)
+            id = "".join(id)
+            if id not in cls.accounts:
+                return id
+
+    # ---------- operations (no input/print, nothing saved; raise BankError) ----------
+    def find(self, accnumber, pin):
+        userdata = Bank.accounts.get(str(accnumber))
+        if userdata is None or userdata['pin'] != pin:
+            raise BankError("Sorry No data Found")
+        return userdata
+
+    def create(self, name, age, email, mob_no, pin, accountNo=None):
+        if age < 18 or len(str(pin)) != 4:
+            raise BankError("Sorry you cannot create your account.")
+        accountNo = accountNo or Bank.__accountgerate()
+        if accountNo in Bank.accounts:
+            raise BankError(f"Account number {accountNo} already exists.")
+        info = {"name": name, "age": age, "email": email, "Mob_no": mob_no, "pin": pin,
+                "accountNo": accountNo, "balance": 0}
+        Bank.accounts[accountNo] = info
+        return info
+
+    def deposit(self, accnumber, pin, amount):
+        userdata = self.find(accnumber, pin)
+        if amount > 10000 or amount <= 0:
+            raise BankError("Sorry the amount is too much, you can deposit below 10000 and more than 0")
+        userdata['balance'] += amount
+        return userdata
+
+    def withdraw(self, accnumber, pin, amount):
+        userdata = self.find(accnumber, pin)
+        if amount > 10000 or amount <= 0 or amount > userdata['balance']:
+            raise BankError("Sorry  you have not a sufficient banck balance")
+        userdata['balance'] -= amount
+        return userdata
+
+    def update(self, accnumber, pin, name="", email="", new_pin=""):
+        # empty values are left unchanged; age, account number and balance cannot change
+        userdata = self.find(accnumber, pin)
+        if new_pin != "":
+            # checked before anything changes, so a bad PIN leaves the account as it was
+            try:
+                new_pin = int(new_pin)
+            except ValueError:
+                raise BankError("New pin must be a 4 digit number.") from None
+            if len(str(new_pin)) != 4:
+                raise BankError("New pin must be a 4 digit number.")
+        if name != "":
+            userdata['name'] = name
+        if email != "":
+            userdata['email'] = email
+        if new_pin != "":
+            userdata['pin'] = new_pin
+        return userdata
+
+    def remove(self, accnumber, pin):
+        userdata = self.find(accnumber, pin)
+        del Bank.accounts[str(userdata['accountNo'])]
+        return userdata
+
+    # ---------- interactive ----------
     def createaccount(self):
-        info = {
-            "name": input("tell me your name:- "),
-            "age": int(input("tell me your age:- ")),
-            "email": input("tell me your email:- "),
-            "Mob_no": input("tell me your mobile number :- "), 
-            "pin": int(input("tell me your 4 Digit pin:- ")),
-            "accountNo": Bank.__accountgerate(),
-            "balance": 0
-        }
-        if info['age'] < 18 or len(str(info["pin"])) != 4:
-            print(" Sorry you cannot create your account.")
-        else:
-            print(" Account has been created Successfully!")
-            for i in info:
-                print(f"{i} : {info[i]}")
-            print(" Please note down your Account Number.")
-
-            Bank.data.append(info)
-            Bank.__Update()
+        try:
+            info = self.create(
+                input("tell me your name:- "),
+                int(input("tell me your age:- ")),
+                input("tell me your email:- "),
+                input("tell me your mobile number :- "),
+                int(input("tell me your 4 Digit pin:- ")),
+            )
+        except BankError as err:
+            print(f" {err}")
+            return
+        print(" Account has been created Successfully!")
+        for i in info:
+            print(f"{i} : {info[i]}")
+        print(" Please note down your Account Number.")
+        Bank.__Update()
 
     def depositmoney(self):   # moved outside createaccount
         accnumber = input("please tell your account Number:- ")
         pin = int(input("please tell your pin aswell:- "))
-
-        userdata = None
-        for i in Bank.data:
-            if i['accountNo'] == accnumber and i['pin'] == pin:
-                userdata = i
-                break
-
-        if not userdata:
-            print("Sorry No data Found")
-        else:
-            amount = int(input("How much amount you want to deposit: "))  
-            if amount > 10000 or amount <= 0:
-                print("Sorry the amount is too much, you can deposit below 10000 and more than 0")
-            else:
-                userdata['balance'] += amount
-                Bank.__Update()
-                print("Amount deposited Successfully!")
+        try:
+            self.find(accnumber, pin)
+            self.deposit(accnumber, pin, int(input("How much amount you want to deposit: ")))
+        except BankError as err:
+            print(err)
+            return
+        Bank.__Update()
+        print("Amount deposited Successfully!")
 
     def withdrawmoney(self):   # moved outside depositammount
         accnumber = input("please tell your account Number:- ")
         pin = int(input("please tell your pin aswell:- "))
-
-        userdata = None
-        for i in Bank.data:
-            if i['accountNo'] == accnumber and i['pin'] == pin:
-                userdata = i
-                break
-
-        if not userdata:
-            print("Sorry No data Found")
-        else:
-            amount = int(input("How much amount you want to Withdraw: "))  
-            if amount > 10000 or amount <= 0:
-                print("Sorry  you have not a sufficient banck balance")
-            else:
-                userdata['balance'] -= amount
-                Bank.__Update()
-                print("Amount Withdraw Successfully!")
-
-    def showdetails(self):   # moved outside withdraw 
+        try:
+            self.find(accnumber, pin)
+            self.withdraw(accnumber, pin, int(input("How much amount you want to Withdraw: ")))
+        except BankError as err:
+            print(err)
+            return
+        Bank.__Update()
+        print("Amount Withdraw Successfully!")
+
+    def showdetails(self):   # moved outside withdraw
         accnumber = input("please tell your account Number:- ")
         pin = int(input("please tell your pin aswell:- "))
-
-        userdata = None
-        for i in Bank.data:
-            if i['accountNo'] == accnumber and i['pin'] == pin:
-                userdata = i
-                break
-
-        if userdata:
-            print("Your account details:")
-            for k, v in userdata.items():
-                print(f"{k}: {v}")
-        else:
-            print("Sorry No data Found")
+        try:
+            userdata = self.find(accnumber, pin)
+        except BankError as err:
+            print(err)
+            return
+        print("Your account details:")
+        for k, v in userdata.items():
+            print(f"{k}: {v}")
 
     def updatedetails(self): # moved outside the showdetails
         accnumber = input("please tell your account number ")
         pin = int(input("please tell your pin aswell "))
-
-        userdata = [i for i in Bank.data if i['accountNo'] == accnumber and i['pin'] == pin]
-
-        if not userdata:
+        try:
+            self.find(accnumber, pin)
+        except BankError:
             print("No such user found ")
-        
-        else:
-            print("You cannot change the age, account number, balance")
-
-            print("Fill the details for change or leave it empty if no change")
-
-            newdata = {
-                "name": input("please tell new name or press enter : "),
-                "email": input("please tell your new Email or press enter to skip :"),
-                "pin": input("enter new Pin or press enter to skip: ")
-            }
-
-            if newdata["name"] == "":
-                newdata["name"] = userdata[0]['name']
-            if newdata["email"] == "":
-                newdata["email"] = userdata[0]['email']
-            if newdata["pin"] == "":
-                newdata["pin"] = userdata[0]['pin']
-            else:
-                newdata['pin'] = int(newdata['pin'])
-            
-            newdata['age'] = userdata[0]['age']
-            newdata['accountNo'] = userdata[0]['accountNo']
-            newdata['balance'] = userdata[0]['balance']
-            newdata['Mob_no'] = userdata[0]['Mob_no']
-
-            # update values
-            for i in newdata:
-                userdata[0][i] = newdata[i]
-
-            Bank.__Update()
-            print("Details updated successfully")
+            return
+        print("You cannot change the age, account number, balance")
+        print("Fill the details for change or leave it empty if no change")
+        try:
+            self.update(
+                accnumber, pin,
+                name=input("please tell new name or press enter : "),
+                email=input("please tell your new Email or press enter to skip :"),
+                new_pin=input("enter new Pin or press enter to skip: "),
+            )
+        except BankError as err:
+            print(err)
+            return
+        Bank.__Update()
+        print("Details updated successfully")
 
     def delete(self):  # move outside the updatedetails
         accnumber = input("please tell your account number: ")
         pin = int(input("please tell your pin as well: "))
-
-        userdata = [i for i in Bank.data if i['accountNo'] == accnumber and i['pin'] == pin]
-
-        if not userdata:
+        try:
+            self.find(accnumber, pin)
+        except BankError:
             print("Sorry, no such data exists")
+            return
+        check = input("Press A if you actually want to delete your account, or press Z to cancel: ")
+        if check.lower() == "a":
+            self.remove(accnumber, pin)
+            Bank.__Update()
+            print("Account deleted successfully.")
         else:
-            check = input("Press A if you actually want to delete your account, or press Z to cancel: ")
-            if check.lower() == "a":
-                index = Bank.data.index(userdata[0])
-                Bank.data.pop(index)
+            print("Deletion cancelled.")
+
+    # ---------- batch ----------
+    def apply(self, op, args):
+        """Run one script operation; returns the text for the report line."""
+        if op == "create":   # create,name,age,email,mobile,pin[,accountNo]
+            name, age, email, mob, pin = args[:5]
+            info = self.create(name, int(age), email, mob, int(pin), args[5] if len(args) > 5 and args[5] else None)
+            return f"created {info['accountNo']}"
+        if op in ("deposit", "withdraw"):   # deposit,accountNo,pin,amount
+            acc, pin, amount = args
+            userdata = getattr(self, op)(acc, int(pin), int(amount))
+            return f"{op} {amount} -> balance {userdata['balance']}"
+        if op == "update":   # update,accountNo,pin,name=..,email=..,pin=..
+            acc, pin = args[:2]
+            fields = dict(a.split("=", 1) for a in args[2:])
+            unknown = set(fields) - {"name", "email", "pin"}
+            if unknown:
+                raise BankError(f"cannot update {', '.join(sorted(unknown))}")
+            self.update(acc, int(pin), fields.get("name", ""), fields.get("email", ""), fields.get("pin", ""))
+            return f"updated {acc}"
+        if op == "delete":   # delete,accountNo,pin
+            acc, pin = args
+            self.remove(acc, int(pin))
+            return f"deleted {acc}"
+        raise BankError(f"unknown operation {op!r}")
+
+    def runbatch(self, lines, checkpoint=0, report=sys.stdout):
+        """Apply a script of comma-separated operations, one per line.
+
+        data.json is written once at the end, plus every `checkpoint`
+        successful operations when that is set. Each line gets an ok/error
+        line in `report`. Returns (ok, failed).
+        """
+        ok = failed = pending = 0
+        for n, row in enumerate(csv.reader(lines), 1):
+            if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+                continue
+            op, args = row[0].strip().lower(), [a.strip() for a in row[1:]]
+            try:
+                result = self.apply(op, args)
+            except BankError as err:
+                failed += 1
+                report.write(f"{n}\terror\t{err}\n")
+                continue
+            except ValueError:
+                failed += 1
+                report.write(f"{n}\terror\tbad arguments for {op}: {','.join(args)}\n")
+                continue
+            ok += 1
+            pending += 1
+            report.write(f"{n}\tok\t{result}\n")
+            if checkpoint and pending >= checkpoint:
                 Bank.__Update()
-                print("Account deleted successfully.")
-            else:
-                print("Deletion cancelled.")
-
-
-user = Bank()
-
-print("Press 1 for creating your account")
-print("Press 2 for deposite money in the Bank")
-print("Press 3 for withdrawing your money")
-print("Press 4 for details")
-print("Press 5 for Updating the details")
-print("Press 6 for deleting your account")
-
-check = int(input("tell your response :- "))
-
-if check == 1:
-    user.createaccount()
-
-if check == 2:
-    user.depositmoney()
-
-if check == 3:
-    user.withdrawmoney()
-
-if check == 4:
-    user.showdetails()
-
-if check == 5:
-    user.updatedetails()
-
-if check == 6:
-    user.delete()
+                pending = 0
+        if pending:
+            Bank.__Update()
+        return ok, failed
+
+
+def menu(user):
+    actions = {1: user.createaccount, 2: user.depositmoney, 3: user.withdrawmoney,
+               4: user.showdetails, 5: user.updatedetails, 6: user.delete}
+    while True:
+        print()
+        print("Press 1 for creating your account")
+        print("Press 2 for deposite money in the Bank")
+        print("Press 3 for withdrawing your money")
+        print("Press 4 for details")
+        print("Press 5 for Updating the details")
+        print("Press 6 for deleting your account")
+        print("Press 0 to exit")
+        try:
+            check = int(input("tell your response :- "))
+        except ValueError:
+            print("Please enter a number.")
+            continue
+        except EOFError:
+            break
+        if check == 0:
+            break
+        if check not in actions:
+            print("Please choose one of the options.")
+            continue
+        try:
+            actions[check]()
+        except ValueError:
+            print("Invalid input, please try again.")
+        except EOFError:
+            break
+
+
+if __name__ == "__main__":
+    user = Bank()
+    args = sys.argv[1:]
+    if args[:1] == ["--batch"] and len(args) >= 2:
+        # python main.py --batch ops.csv|- [--checkpoint N]
+        every = int(args[args.index("--checkpoint") + 1]) if "--checkpoint" in args else 0
+        t0 = time.perf_counter()
+        if args[1] == "-":
+            ok, failed = user.runbatch(sys.stdin, every)
+        else:
+            with open(args[1], newline="") as fs:
+                ok, failed = user.runbatch(fs, every)
+        print(f"{ok} ok, {failed} failed in {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+    elif not args:
+        menu(user)
+    else:
+        print("usage: python main.py | --batch FILE|- [--checkpoint N]")
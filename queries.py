@@ -0,0 +1,92 @@
+# queries.py
+# Read paths the web app runs on every Streamlit rerun (login lookup, the logged-in customer,
+# recent transactions) as Core selects built once at import. They return plain rows with just
+# the columns the page shows, skipping ORM identity-map and relationship bookkeeping.
+#   python queries.py --bench [RERUNS]   -> CPU time per login + page rerun, ORM vs these selects
+import sys
+from sqlalchemy import select, bindparam
+from bank_db import Customer, Transaction, current_balance
+
+customers = Customer.__table__
+transactions = Transaction.__table__
+
+_login = select(customers.c.id, customers.c.account_no, customers.c.pin_hash) \
+    .where(customers.c.account_no == bindparam("acc"))
+# balance includes hot-account slots, so the page needs no second query for those
+_dashboard = select(
+    customers.c.id, customers.c.name, customers.c.account_no, customers.c.account_type, customers.c.hot_slots,
+    current_balance.label("balance"),
+).where(customers.c.id == bindparam("cid"))
+_recent = select(transactions.c.type, transactions.c.amount, transactions.c.timestamp, transactions.c.note) \
+    .where(transactions.c.customer_id == bindparam("cid")) \
+    .order_by(transactions.c.timestamp.desc()).limit(bindparam("n"))
+
+
+def login_row(conn, account_no):
+    """(id, account_no, pin_hash) for `account_no`, or None."""
+    return conn.execute(_login, {"acc": account_no}).first()
+
+
+def customer_row(conn, customer_id):
+    """(id, name, account_no, account_type, hot_slots, balance) for the logged-in page, or None."""
+    return conn.execute(_dashboard, {"cid": customer_id}).first()
+
+
+def recent_transactions(conn, customer_id, n=10):
+    """The latest `n` transactions as (type, amount, timestamp, note), newest first."""
+    return conn.execute(_recent, {"cid": customer_id, "n": n}).all()
+
+
+def _bench(reruns=5000):
+    import os, random, tempfile, time, warnings
+    from sqlalchemy import insert
+    from sqlalchemy.orm import sessionmaker
+    from bank_db import init_db, make_engine, utcnow
+
+    warnings.simplefilter("ignore")  # Query.get() is legacy API; the old page used it
+    eng = make_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    init_db(eng)
+    n_customers = 1000
+    now = utcnow()
+    with eng.begin() as conn:
+        conn.execute(insert(customers), [{"name": f"c{i}", "age": 30, "email": f"{i}@bench", "account_no": f"B{i:06d}",
+                                          "pin_hash": "x", "balance": 100.0} for i in range(n_customers)])
+        conn.execute(insert(transactions), [{"customer_id": i % n_customers + 1, "amount": 1.0, "type": "deposit",
+                                             "timestamp": now, "note": None} for i in range(50 * n_customers)])
+    Session = sessionmaker(bind=eng)
+    rnd = random.Random(5)
+    ids = [rnd.randrange(1, n_customers + 1) for _ in range(reruns)]
+
+    def orm(cid):
+        db = Session()
+        user = db.query(Customer).filter(Customer.account_no == f"B{cid - 1:06d}").first()
+        user = db.query(Customer).get(user.id)
+        txs = db.query(Transaction).filter(Transaction.customer_id == user.id) \
+            .order_by(Transaction.timestamp.desc()).limit(10).all()
+        page = (user.name, user.balance, [(t.type, t.amount, t.timestamp, t.note) for t in txs])
+        db.close()
+        return page
+
+    def core(cid):
+        with eng.connect() as conn:
+            me = customer_row(conn, login_row(conn, f"B{cid - 1:06d}").id)
+            return me.name, me.balance, [tuple(t) for t in recent_transactions(conn, me.id)]
+
+    assert orm(ids[0]) == core(ids[0])
+    for label, fn in (("ORM", orm), ("Core selects", core)):
+        for cid in ids[:200]:  # warm the statement caches
+            fn(cid)
+        cpu, wall = time.process_time(), time.perf_counter()
+        for cid in ids:
+            fn(cid)
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        print(f"{label:<13} {cpu / reruns * 1e6:8.1f} us CPU per rerun ({wall / reruns * 1e6:8.1f} us wall; "
+              f"login lookup, customer, 10 recent transactions)")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--bench"]:
+        _bench(int(args[1]) if len(args) > 1 else 5000)
+    else:
+        print("usage: python queries.py --bench [RERUNS]")
@@ -0,0 +1,110 @@
+# search.py
+# Indexed customer search for the admin panel (name, email, mobile, account number).
+#   SQLite:   FTS5 trigram index kept in sync with `customers` by triggers
+#   Postgres: pg_trgm GIN indexes, queried with ILIKE
+#   python search.py QUERY     -> print the top matches
+import sys
+from sqlalchemy import text, select, or_, func
+from sqlalchemy.exc import OperationalError
+from bank_db import engine, Customer
+
+customers = Customer.__table__
+FIELDS = ("name", "email", "mob_no", "account_no")
+CANDIDATES = 2000
+
+_SQLITE_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS customer_search_ai AFTER INSERT ON customers BEGIN
+        INSERT INTO customer_search(rowid, name, email, mob_no, account_no)
+        VALUES (new.id, new.name, new.email, new.mob_no, new.account_no);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS customer_search_ad AFTER DELETE ON customers BEGIN
+        INSERT INTO customer_search(customer_search, rowid, name, email, mob_no, account_no)
+        VALUES ('delete', old.id, old.name, old.email, old.mob_no, old.account_no);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS customer_search_au AFTER UPDATE OF name, email, mob_no, account_no ON customers BEGIN
+        INSERT INTO customer_search(customer_search, rowid, name, email, mob_no, account_no)
+        VALUES ('delete', old.id, old.name, old.email, old.mob_no, old.account_no);
+        INSERT INTO customer_search(rowid, name, email, mob_no, account_no)
+        VALUES (new.id, new.name, new.email, new.mob_no, new.account_no);
+    END""",
+]
+
+_PG_DDL = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS ix_customers_{f}_trgm ON customers USING gin (lower({f}) gin_trgm_ops)"
+    for f in FIELDS
+]
+
+
+def init_search(bind, rebuild=False):
+    # rebuild=True re-reads the whole customers table into the index (e.g. after a DB reset)
+    if bind.dialect.name == "sqlite":
+        with bind.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'customer_search'"
+            ).first()
+            if not exists:
+                cols = ", ".join(FIELDS)
+                try:
+                    conn.exec_driver_sql(
+                        f"CREATE VIRTUAL TABLE customer_search USING fts5({cols}, "
+                        "content='customers', content_rowid='id', tokenize='trigram')"
+                    )
+                except OperationalError:
+                    # SQLite < 3.34 has no trigram tokenizer: fall back to prefix indexes
+                    conn.exec_driver_sql(
+                        f"CREATE VIRTUAL TABLE customer_search USING fts5({cols}, "
+                        "content='customers', content_rowid='id', prefix='2 3 4')"
+                    )
+                rebuild = True
+            if rebuild:
+                conn.exec_driver_sql("INSERT INTO customer_search(customer_search) VALUES ('rebuild')")
+            for ddl in _SQLITE_DDL:
+                conn.exec_driver_sql(ddl)
+    elif bind.dialect.name == "postgresql":
+        with bind.begin() as conn:
+            for ddl in _PG_DDL:
+                conn.exec_driver_sql(ddl)
+
+
+init_search(engine)
+
+
+def _like_query(q, limit):
+    # Postgres (trigram GIN indexes serve these ILIKEs) and any other backend
+    pattern = "%" + q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return select(customers).where(
+        or_(*[func.lower(customers.c[f]).like(pattern, escape="\\") for f in FIELDS])
+    ).limit(limit)
+
+
+def search_customers(conn, q, limit=20):
+    """Top `limit` customers matching `q` anywhere in name, email, mobile or account number."""
+    q = (q or "").strip()
+    if not q:
+        return []
+    if conn.dialect.name != "sqlite":
+        return conn.execute(_like_query(q, limit)).all()
+
+    trigram = "trigram" in conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE name = 'customer_search'"
+    ).scalar()
+    if trigram and len(q) < 3:
+        # trigrams need 3+ characters; short input is matched as a prefix
+        pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return conn.execute(
+            select(customers).where(or_(*[customers.c[f].like(pattern, escape="\\") for f in FIELDS])).limit(limit)
+        ).all()
+    phrase = '"' + q.replace('"', '""') + '"'
+    if not trigram:
+        phrase += " *"
+    # rank at most CANDIDATES hits, so a very common fragment ("mail.com") stays fast
+    return conn.execute(text(
+        "SELECT c.* FROM (SELECT rowid, rank FROM customer_search WHERE customer_search MATCH :q LIMIT :cap) s "
+        "JOIN customers c ON c.id = s.rowid ORDER BY s.rank LIMIT :n"
+    ), {"q": phrase, "cap": CANDIDATES, "n": limit}).all()
+
+
+if __name__ == "__main__":
+    with engine.connect() as conn:
+        for row in search_customers(conn, " ".join(sys.argv[1:])):
+            print(row.id, row.account_no, row.name, row.email, row.mob_no, f"{row.balance or 0:,.2f}")
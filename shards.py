@@ -0,0 +1,311 @@
+# shards.py
+# Horizontal sharding: each customer lives on one of several databases, chosen by a hash
+# of their account number, so postings for customers on different shards commit in parallel.
+# The shard map is the JSON file SHARD_MAP (default shards.json); without it there is a
+# single shard, DB_URL, and everything behaves as before.
+#   python shards.py status                  -> shards, hash ranges and customer counts
+#   python shards.py split INDEX NEW_URL     -> move half of a shard's hash range to a new database
+#   python shards.py --bench [SECONDS] [WORKERS] -> post_transaction() throughput with 1, 2, 4 and 8 shards
+import json
+import os
+import sys
+import time
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from sqlalchemy import select, delete, insert, func, text
+from sqlalchemy.orm import sessionmaker
+from bank_db import (
+    DB_URL, engine, SessionLocal, make_engine, init_db, watch_customers,
+    Customer, Transaction, MonthlySummary, BalanceCheckpoint, DailyTotal, BalanceSlot, IdempotencyKey,
+)
+from search import init_search
+from archive import archive_dir_for, copy_customers, drop_customers
+from bulk_post import post_bulk, CHUNK_SIZE, MOVED
+
+SHARD_MAP = os.getenv("SHARD_MAP", "shards.json")
+HASH_SPACE = 1 << 32
+RELOAD_EVERY = 1.0  # seconds between checks for a map rewritten by split()
+
+customers = Customer.__table__
+# rows that belong to a customer and move with them on a split
+CUSTOMER_TABLES = (
+    Transaction.__table__, MonthlySummary.__table__, BalanceCheckpoint.__table__, DailyTotal.__table__,
+    BalanceSlot.__table__, IdempotencyKey.__table__,
+)
+
+
+def shard_key(account_no):
+    # stable across processes and Python versions, unlike hash()
+    return zlib.crc32(str(account_no).encode())
+
+
+class ShardRouter:
+    """Maps account numbers to shard engines and sessions.
+
+    `shards` is a list of {"url": ..., "ranges": [[lo, hi], ...]} whose hash
+    ranges cover [0, 2**32) exactly once. Customer ids are only unique within
+    a shard; use the account number (or shard index and id) across shards.
+    """
+
+    def __init__(self, shards, path=None):
+        self.path = path
+        self._engines = {DB_URL: engine}
+        self._sessions = {DB_URL: SessionLocal}
+        self._pool = None
+        self._use(shards)
+
+    @classmethod
+    def load(cls, path=SHARD_MAP):
+        if os.path.exists(path):
+            with open(path) as fs:
+                return cls(json.load(fs)["shards"], path)
+        return cls([{"url": DB_URL, "ranges": [[0, HASH_SPACE]]}], path)
+
+    def _use(self, shards):
+        bounds = sorted((lo, hi, i) for i, s in enumerate(shards) for lo, hi in s["ranges"])
+        pos = 0
+        for lo, hi, _ in bounds:
+            if lo != pos or hi <= lo:
+                raise ValueError(f"shard ranges must cover [0, {HASH_SPACE}) without gaps or overlaps")
+            pos = hi
+        if pos != HASH_SPACE:
+            raise ValueError(f"shard ranges must cover [0, {HASH_SPACE}) without gaps or overlaps")
+        for s in shards:
+            if s["url"] not in self._engines:
+                eng = self._engines[s["url"]] = make_engine(s["url"])
+                init_db(eng)
+                init_search(eng)
+                self._sessions[s["url"]] = watch_customers(sessionmaker(bind=eng))
+        self.shards = shards
+        self.engines = [self._engines[s["url"]] for s in shards]
+        self._lows = [lo for lo, _, _ in bounds]
+        self._owner = [i for _, _, i in bounds]
+        self._mtime = os.path.getmtime(self.path) if self.path and os.path.exists(self.path) else None
+        self._checked = time.monotonic()
+
+    def _refresh(self):
+        if self.path is None or time.monotonic() - self._checked < RELOAD_EVERY:
+            return
+        self._checked = time.monotonic()
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime != self._mtime:
+            with open(self.path) as fs:
+                self._use(json.load(fs)["shards"])
+
+    def __len__(self):
+        return len(self.shards)
+
+    def index_for(self, account_no):
+        self._refresh()
+        return self._owner[bisect_right(self._lows, shard_key(account_no)) - 1]
+
+    def engine_for(self, account_no):
+        return self.engines[self.index_for(account_no)]
+
+    def session_for(self, account_no):
+        return self._sessions[self.shards[self.index_for(account_no)]["url"]]()
+
+    def all_engines(self):
+        """Every shard's engine, under the map as split() last left it."""
+        self._refresh()
+        return list(self.engines)
+
+    def fan_out(self, fn):
+        """Run fn(conn) on every shard in parallel; results in shard order."""
+        self._refresh()
+        if len(self.engines) == 1:
+            with self.engines[0].connect() as conn:
+                return [fn(conn)]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="shard")
+
+        def run(eng):
+            with eng.connect() as conn:
+                return fn(conn)
+        return list(self._pool.map(run, self.engines))
+
+
+def save_map(shards, path=SHARD_MAP):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fs:
+        json.dump({"shards": shards}, fs, indent=2)
+    os.replace(tmp, path)
+
+
+def _chunks(seq, n=900):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+
+def split(router, index, new_url):
+    """Move the upper half of shard `index`'s largest hash range to a new database.
+
+    The source shard's write lock is held from the first read until the moved
+    rows are deleted, so every posting committed before it is copied. The map
+    is rewritten only after that delete has committed. Until then, a posting
+    routed to the old shard matches no customers row and is rolled back (see
+    post_bulk_sharded for the retry); other shards keep running. The moved
+    customers' archived partitions (archive.py) move with them.
+
+    A rerun after a crash finishes the interrupted split. The old map is still
+    in place, so it picks the same range. Customers that are in the new
+    database but no longer in the source were moved, and they stay where they
+    are. Copies of customers still in the source are replaced.
+    Returns the number of customers moved.
+    """
+    src = router.shards[index]
+    lo, hi = max(src["ranges"], key=lambda r: r[1] - r[0])
+    if hi - lo < 2:
+        raise ValueError("range too small to split")
+    mid = (lo + hi) // 2
+
+    dst = make_engine(new_url)
+    init_db(dst)
+    init_search(dst)
+    with router.engines[index].connect() as sconn:
+        with sconn.begin():
+            if sconn.dialect.name == "sqlite":
+                sconn.execute(text("UPDATE customers SET id = id WHERE 0"))  # takes the write lock now
+            else:
+                sconn.execute(text("LOCK TABLE customers IN SHARE ROW EXCLUSIVE MODE"))
+            ids = [cid for cid, acc in sconn.execute(select(customers.c.id, customers.c.account_no))
+                   if mid <= shard_key(acc) < hi]
+
+            with dst.begin() as dconn:
+                theirs = [cid for cid, acc in dconn.execute(select(customers.c.id, customers.c.account_no))
+                          if mid <= shard_key(acc) < hi]
+                if len(theirs) != dconn.execute(select(func.count()).select_from(customers)).scalar():
+                    raise ValueError(f"{new_url} already holds other customers")
+                # copies left by an attempt that stopped before the source delete committed
+                stale = sorted(set(theirs) & set(ids))
+                for part in _chunks(stale):
+                    for table in CUSTOMER_TABLES:
+                        dconn.execute(delete(table).where(table.c.customer_id.in_(part)))
+                    dconn.execute(delete(customers).where(customers.c.id.in_(part)))
+                for part in _chunks(ids):
+                    rows = [dict(r._mapping) for r in sconn.execute(select(customers).where(customers.c.id.in_(part)))]
+                    dconn.execute(insert(customers), rows)
+                    for table in CUSTOMER_TABLES:
+                        rows = [dict(r._mapping) for r in sconn.execute(select(table).where(table.c.customer_id.in_(part)))]
+                        if rows:
+                            dconn.execute(insert(table), rows)
+            moved = sorted(set(theirs) | set(ids))
+            copy_customers(moved, archive_dir_for(sconn), archive_dir_for(dst))
+
+            for part in _chunks(ids):
+                for table in CUSTOMER_TABLES:
+                    sconn.execute(delete(table).where(table.c.customer_id.in_(part)))
+                sconn.execute(delete(customers).where(customers.c.id.in_(part)))
+        drop_customers(moved, archive_dir_for(sconn))
+
+    shards = [dict(s) for s in router.shards]
+    shards[index]["ranges"] = [[lo, mid] if r == [lo, hi] else r for r in src["ranges"]]
+    shards.append({"url": new_url, "ranges": [[mid, hi]]})
+    save_map(shards, router.path or SHARD_MAP)
+    router._use(shards)
+    return len(moved)
+
+
+def _post_routed(router, numbered, chunk_size):
+    # post_bulk() per shard in parallel; rejections carry the shard they were posted to
+    groups = {}
+    for n, row in numbered:
+        acc = row[0] if isinstance(row, (tuple, list)) and row else ""
+        nums, part = groups.setdefault(router.index_for(acc), ([], []))
+        nums.append(n)
+        part.append(row)
+
+    def run(i):
+        return i, post_bulk(groups[i][1], chunk_size, bind=router.engines[i])
+    posted, rejected = 0, []
+    with ThreadPoolExecutor(max_workers=max(len(groups), 1)) as pool:
+        for i, res in pool.map(run, list(groups)):
+            posted += res["posted"]
+            rejected += [(groups[i][0][n - 1], row, why, i) for n, row, why in res["rejected"]]
+    return posted, rejected
+
+
+def post_bulk_sharded(router, rows, chunk_size=CHUNK_SIZE):
+    """post_bulk() with each row sent to its account's shard; shards are posted in parallel.
+
+    Rows whose account was moved by a split() while they were posting come
+    back unposted from the old shard; they are sent once more to the shard
+    the reloaded map names. Returns the same result as post_bulk(), with row
+    numbers of the whole input.
+    """
+    posted, rejected = _post_routed(router, enumerate(rows, 1), chunk_size)
+    router._checked = float("-inf")  # re-read the map now
+    router._refresh()
+    moved = [(n, row) for n, row, why, i in rejected
+             if why in (MOVED, "account not found") and router.index_for(row[0]) != i]
+    if moved:
+        again = {n for n, _ in moved}
+        rejected = [r for r in rejected if r[0] not in again]
+        n_posted, more = _post_routed(router, moved, chunk_size)
+        posted += n_posted
+        rejected += more
+    return {"posted": posted, "rejected": sorted(((n, row, why) for n, row, why, _ in rejected), key=lambda r: r[0])}
+
+
+def status(router):
+    counts = router.fan_out(lambda conn: conn.execute(select(func.count()).select_from(customers)).scalar())
+    return [(i, s["url"], s["ranges"], n) for i, (s, n) in enumerate(zip(router.shards, counts))]
+
+
+# ---------- BENCHMARK ----------
+def _bench_worker(path, accounts, seconds, seed):
+    import random
+    from bank_db import post_transaction
+    rnd = random.Random(seed)
+    router = ShardRouter.load(path)
+    sessions, users = {}, {}
+    done, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        acc = rnd.choice(accounts)
+        i = router.index_for(acc)
+        db = sessions.get(i) or sessions.setdefault(i, router.session_for(acc))
+        user = users.get(acc) or users.setdefault(acc, db.query(Customer).filter(Customer.account_no == acc).one())
+        post_transaction(db, user, 10.0, "deposit", "bench")  # the app's posting path
+        done += 1
+    for db in sessions.values():
+        db.close()
+    return done
+
+
+def _bench(seconds=5.0, workers=16, shard_counts=(1, 2, 4, 8), n_accounts=2000):
+    import tempfile
+    for n in shard_counts:
+        d = tempfile.mkdtemp()
+        path = os.path.join(d, "shards.json")
+        step = HASH_SPACE // n
+        save_map([{"url": f"sqlite:///{d}/shard{i}.db", "ranges": [[i * step, HASH_SPACE if i == n - 1 else (i + 1) * step]]}
+                  for i in range(n)], path)
+        router = ShardRouter.load(path)
+        by_shard = {}
+        for i in range(n_accounts):
+            acc = f"B{i:08d}"
+            by_shard.setdefault(router.index_for(acc), []).append(
+                {"name": "b", "age": 30, "email": f"{i}@bench", "account_no": acc, "pin_hash": "x", "balance": 0.0})
+        for i, rows in by_shard.items():
+            with router.engines[i].begin() as conn:
+                conn.execute(insert(customers), rows)
+        accounts = [f"B{i:08d}" for i in range(n_accounts)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            total = sum(pool.map(_bench_worker, [path] * workers, [accounts] * workers,
+                                 [seconds] * workers, range(workers)))
+        print(f"{n} shard(s), {workers} writer processes, post_transaction: {total / seconds:,.0f} postings/sec")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--bench"]:
+        _bench(float(args[1]) if len(args) > 1 else 5.0, int(args[2]) if len(args) > 2 else 16)
+    elif args[:1] == ["split"] and len(args) == 3:
+        r = ShardRouter.load()
+        print(f"moved {split(r, int(args[1]), args[2])} customers to shard {len(r) - 1} ({args[2]})")
+    elif args[:1] == ["status"]:
+        for i, url, ranges, n in status(ShardRouter.load()):
+            print(f"{i}: {url}  {n} customers  ranges {ranges}")
+    else:
+        print("usage: python shards.py status | split INDEX NEW_URL | --bench [SECONDS] [WORKERS]")
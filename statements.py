@@ -0,0 +1,218 @@
+# statements.py
+# Monthly statement batch job.
+#   python statements.py 2026-09 [--out DIR] [--workers N]   -> render one file per customer, all shards
+#   python statements.py --rebuild-summary                   -> recompute monthly_summary from history
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select, delete, insert, func
+from bank_db import engine, Customer, Transaction, MonthlySummary, CREDIT_TYPES, db_label
+from archive import CARRY, archive_dir_for, archived_until, load_partition
+
+customers = Customer.__table__
+transactions = Transaction.__table__
+summaries = MonthlySummary.__table__
+
+BATCH = 500  # customers per worker task
+
+
+def month_range(month):
+    start = datetime.strptime(month, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def rebuild_monthly_summary(bind=None):
+    """Recompute monthly_summary from the full transaction history in one pass.
+
+    Only needed for data posted before the table existed, or after a repair.
+    Archived months are left as they are.
+    """
+    bind = bind if bind is not None else engine
+    rows, cur, bal, month_row = [], None, 0.0, None
+    with bind.begin() as conn:
+        q = select(transactions.c.customer_id, transactions.c.timestamp, transactions.c.type, transactions.c.amount) \
+            .order_by(transactions.c.customer_id, transactions.c.timestamp, transactions.c.id)
+        for cid, ts, kind, amount in conn.execution_options(stream_results=True).execute(q):
+            if cid != cur:
+                cur, bal, month_row = cid, 0.0, None
+            if kind == CARRY:  # archived history: starting balance, not activity
+                bal += amount
+                continue
+            m = ts.strftime("%Y-%m")
+            if month_row is None or month_row["month"] != m:
+                month_row = {"customer_id": cid, "month": m, "opening": bal, "credits": 0.0, "debits": 0.0, "closing": bal, "postings": 0}
+                rows.append(month_row)
+            if kind in CREDIT_TYPES:
+                month_row["credits"] += amount
+                bal += amount
+            else:
+                month_row["debits"] += amount
+                bal -= amount
+            month_row["closing"] = bal
+            month_row["postings"] += 1
+        # months already moved to the archive keep their summary rows
+        until = archived_until(archive_dir_for(conn))
+        if until is None:
+            conn.execute(delete(summaries))
+        else:
+            conn.execute(delete(summaries).where(summaries.c.month >= until.strftime("%Y-%m")))
+        if rows:
+            conn.execute(insert(summaries), rows)
+    return len(rows)
+
+
+def _safe(acc):
+    return re.sub(r"[^A-Za-z0-9]", "_", acc)
+
+
+def _render_batch(out_dir, month, items):
+    # runs in a worker process; only formats and writes files
+    for cid, acc, name, opening, rows in items:
+        bal, cr, dr = opening, 0.0, 0.0
+        lines = [
+            f"Secure Bank - Statement for {month}",
+            f"Account: {acc}    Name: {name}",
+            f"Opening balance: {opening:,.2f}",
+            "",
+            f"{'date':<20} {'type':<13} {'amount':>12} {'balance':>12}  note",
+        ]
+        for ts, kind, amount, note in rows:
+            if kind in CREDIT_TYPES:
+                bal += amount
+                cr += amount
+            else:
+                bal -= amount
+                dr += amount
+            lines.append(f"{ts:%Y-%m-%d %H:%M:%S}  {kind:<13} {amount:>12,.2f} {bal:>12,.2f}  {note or ''}")
+        if not rows:
+            lines.append("(no transactions this month)")
+        lines += ["", f"Total credits: {cr:,.2f}", f"Total debits:  {dr:,.2f}", f"Closing balance: {bal:,.2f}", ""]
+        with open(os.path.join(out_dir, f"{cid:08d}_{_safe(acc)}.txt"), "w") as fs:
+            fs.write("\n".join(lines))
+    return len(items)
+
+
+def _load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as fs:
+            return json.load(fs)["last_customer_id"]
+    return 0
+
+
+def _save_checkpoint(path, last_cid):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fs:
+        json.dump({"last_customer_id": last_cid}, fs)
+    os.replace(tmp, path)
+
+
+def _statement_items(conn, month, after):
+    """Yield (customer_id, account_no, name, opening, rows) for every customer with id > after.
+
+    Customers and the month's transactions are both read in customer-id order
+    and merged, so the month is scanned exactly once.
+    """
+    start, end = month_range(month)
+    openings = dict(conn.execute(
+        select(summaries.c.customer_id, summaries.c.opening).where(summaries.c.month == month)
+    ).all())
+    # carry-forward for customers with no activity this month: last closing before it
+    last = select(summaries.c.customer_id, func.max(summaries.c.month).label("m")) \
+        .where(summaries.c.month < month).group_by(summaries.c.customer_id).subquery()
+    carried = dict(conn.execute(
+        select(summaries.c.customer_id, summaries.c.closing)
+        .join(last, (summaries.c.customer_id == last.c.customer_id) & (summaries.c.month == last.c.m))
+    ).all())
+
+    part = load_partition(month, archive_dir_for(conn))
+    if part is not None:
+        # archived month: the partition is already sorted by customer and time
+        i = int(np.searchsorted(part["customer_id"], after, "right"))
+        txs = zip(part["customer_id"][i:].tolist(), part["timestamp"][i:].tolist(), part["type"][i:].tolist(),
+                  part["amount"][i:].tolist(), [n or None for n in part["note"][i:].tolist()])
+        txs = (r for r in txs if r[2] != CARRY)
+    else:
+        txq = select(transactions.c.customer_id, transactions.c.timestamp, transactions.c.type,
+                     transactions.c.amount, transactions.c.note) \
+            .where(transactions.c.timestamp >= start, transactions.c.timestamp < end,
+                   transactions.c.customer_id > after, transactions.c.type != CARRY) \
+            .order_by(transactions.c.customer_id, transactions.c.timestamp, transactions.c.id)
+        txs = iter(conn.execution_options(stream_results=True).execute(txq))
+    pending = next(txs, None)
+
+    custq = select(customers.c.id, customers.c.account_no, customers.c.name) \
+        .where(customers.c.id > after).order_by(customers.c.id)
+    for cid, acc, name in conn.execute(custq).all():
+        while pending is not None and pending[0] < cid:  # orphaned rows
+            pending = next(txs, None)
+        rows = []
+        while pending is not None and pending[0] == cid:
+            rows.append(tuple(pending[1:]))
+            pending = next(txs, None)
+        opening = openings.get(cid, carried.get(cid, 0.0))
+        yield cid, acc, name, opening, rows
+
+
+def run_statements(month, out_dir="statements", workers=None, bind=None):
+    """Write one statement file per customer for `month` ("YYYY-MM").
+
+    Rendering is spread over a process pool. Progress is checkpointed after
+    every finished batch, so an interrupted run resumes where it stopped.
+    Shards share `out_dir` (files are named by account number), each with its
+    own checkpoint.
+    """
+    bind = bind if bind is not None else engine
+    month_dir = os.path.join(out_dir, month)
+    os.makedirs(month_dir, exist_ok=True)
+    label = db_label(bind)
+    ckpt = os.path.join(month_dir, f".checkpoint-{label}" if label else ".checkpoint")
+    after = _load_checkpoint(ckpt)
+    workers = workers or os.cpu_count()
+    done = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, bind.connect() as conn:
+        inflight = deque()  # (last customer id of batch, future), in submission order
+
+        def finish_oldest():
+            nonlocal done
+            last_cid, fut = inflight.popleft()
+            done += fut.result()
+            _save_checkpoint(ckpt, last_cid)
+
+        batch = []
+        for item in _statement_items(conn, month, after):
+            batch.append(item)
+            if len(batch) >= BATCH:
+                inflight.append((batch[-1][0], pool.submit(_render_batch, month_dir, month, batch)))
+                batch = []
+                if len(inflight) >= workers * 2:
+                    finish_oldest()
+        if batch:
+            inflight.append((batch[-1][0], pool.submit(_render_batch, month_dir, month, batch)))
+        while inflight:
+            finish_oldest()
+    return done
+
+
+if __name__ == "__main__":
+    from shards import ShardRouter
+
+    args = sys.argv[1:]
+    engines = ShardRouter.load().all_engines()
+    if args[:1] == ["--rebuild-summary"]:
+        print(f"rebuilt {sum(rebuild_monthly_summary(eng) for eng in engines)} monthly summary rows")
+    elif args and re.fullmatch(r"\d{4}-\d{2}", args[0]):
+        out = args[args.index("--out") + 1] if "--out" in args else "statements"
+        n_workers = int(args[args.index("--workers") + 1]) if "--workers" in args else None
+        t0 = time.perf_counter()
+        n = sum(run_statements(args[0], out, n_workers, bind=eng) for eng in engines)
+        print(f"wrote {n} statements to {os.path.join(out, args[0])} in {time.perf_counter() - t0:.2f}s")
+    else:
+        print("usage: python statements.py YYYY-MM [--out DIR] [--workers N] | --rebuild-summary")
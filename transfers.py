@@ -0,0 +1,134 @@
+# transfers.py
+# Atomic account-to-account transfers.
+#   python transfers.py --bench [THREADS] [SECONDS]  -> concurrent stress benchmark
+import sys
+import uuid
+from sqlalchemy import select, update, insert, text
+from bank_db import engine, Customer, Transaction, current_balance, record_postings, utcnow
+from limits import check_daily_limit
+
+customers = Customer.__table__
+transactions = Transaction.__table__
+
+
+class TransferError(ValueError):
+    pass
+
+
+def transfer(src_acc, dst_acc, amount, note=None, bind=None):
+    """Move `amount` from account `src_acc` to `dst_acc` in one database transaction.
+
+    Both rows are locked in customer-id order, so two transfers running in
+    opposite directions between the same accounts can never deadlock.
+    Writes a transfer_out/transfer_in pair of Transaction rows sharing one `ref`,
+    which is returned. Raises TransferError if the transfer is not possible.
+    """
+    bind = bind if bind is not None else engine
+    amount = float(amount)
+    if not amount > 0:
+        raise TransferError("Amount must be positive.")
+    if src_acc == dst_acc:
+        raise TransferError("Cannot transfer to the same account.")
+
+    ref = uuid.uuid4().hex
+    with bind.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            # take the database write lock before reading anything, so the daily limit and
+            # balance are checked against every posting committed before this one
+            conn.execute(text("UPDATE customers SET id = id WHERE 0"))
+        q = select(customers.c.account_no, customers.c.id, customers.c.account_type).where(
+            customers.c.account_no.in_([src_acc, dst_acc])
+        ).order_by(customers.c.id)
+        if conn.dialect.name != "sqlite":
+            # row locks, always taken lowest id first
+            q = q.with_for_update()
+        found = {acc: (cid, kind) for acc, cid, kind in conn.execute(q)}
+        if src_acc not in found:
+            raise TransferError("Source account not found.")
+        if dst_acc not in found:
+            raise TransferError("Destination account not found.")
+        (src, src_type), (dst, _) = found[src_acc], found[dst_acc]
+        over = check_daily_limit(conn, src, src_type, "transfer_out", amount)
+        if over:
+            raise TransferError(over)
+
+        debited = conn.execute(
+            update(customers)
+            .where(customers.c.id == src, current_balance >= amount)
+            .values(balance=customers.c.balance - amount)
+        ).rowcount
+        if debited != 1:
+            raise TransferError("Insufficient funds.")
+        credited = conn.execute(
+            update(customers).where(customers.c.id == dst).values(balance=customers.c.balance + amount)
+        ).rowcount
+        if credited != 1:
+            # gone since the lookup (moved by shards.split); raising rolls back the debit
+            raise TransferError("Destination account not found.")
+        now = utcnow()
+        legs = [
+            {"customer_id": src, "amount": amount, "type": "transfer_out", "timestamp": now,
+             "note": note or f"to {dst_acc}", "ref": ref},
+            {"customer_id": dst, "amount": amount, "type": "transfer_in", "timestamp": now,
+             "note": note or f"from {src_acc}", "ref": ref},
+        ]
+        conn.execute(insert(transactions), legs)
+        record_postings(conn, legs)
+    return ref
+
+
+def _bench(threads=8, seconds=5.0, n_accounts=20):
+    import os, random, tempfile, threading, time
+    from sqlalchemy import func
+    from bank_db import init_db, make_engine
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    eng = make_engine(f"sqlite:///{path}")
+    init_db(eng)
+    accs = [f"T{i:04d}" for i in range(n_accounts)]
+    with eng.begin() as conn:
+        conn.execute(insert(customers), [
+            {"name": a, "age": 30, "email": f"{a}@bench", "account_no": a, "pin_hash": "x", "balance": 1000.0}
+            for a in accs
+        ])
+    total_before = n_accounts * 1000.0
+
+    done, failed = [0] * threads, [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        rnd = random.Random(i)
+        # half the threads hammer the same pair in the opposite direction
+        while time.perf_counter() < stop:
+            a, b = (accs[0], accs[1]) if rnd.random() < 0.5 else rnd.sample(accs, 2)
+            if i % 2:
+                a, b = b, a
+            try:
+                transfer(a, b, rnd.randint(1, 50), bind=eng)
+                done[i] += 1
+            except TransferError:
+                failed[i] += 1
+
+    t0 = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    dt = time.perf_counter() - t0
+
+    with eng.connect() as conn:
+        total_after = conn.execute(select(func.sum(customers.c.balance))).scalar()
+        legs = conn.execute(select(func.count()).select_from(transactions)).scalar()
+    print(f"{sum(done)} transfers ({sum(failed)} rejected) by {threads} threads in {dt:.2f}s "
+          f"-> {sum(done) / dt:,.0f} transfers/sec")
+    print(f"money before {total_before:,.2f} after {total_after:,.2f} "
+          f"-> {'conserved' if abs(total_after - total_before) < 1e-6 else 'NOT CONSERVED'}; "
+          f"{legs} transaction rows for {sum(done)} transfers")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        _bench(int(sys.argv[2]) if len(sys.argv) > 2 else 8, float(sys.argv[3]) if len(sys.argv) > 3 else 5.0)
+    else:
+        print("usage: python transfers.py --bench [THREADS] [SECONDS]")